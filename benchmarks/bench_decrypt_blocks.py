@@ -0,0 +1,37 @@
+# Benchmark: batched XXTEA decryption
+#
+# Compares one Decryption object per block (how assets are deciphered one by
+# one) with decrypt_blocks() on its "xxtea" and "numpy" backends.
+#
+# Usage: python -m benchmarks.bench_decrypt_blocks [block_size] [batch sizes...]
+
+import os
+import sys
+
+from lunii.bench import best_of
+from lunii.utils import Decryption, decrypt_blocks
+
+def main():
+    block_size = int(sys.argv[1]) if len(sys.argv) > 1 else 0x200
+    batches = [int(arg) for arg in sys.argv[2:]] or [100, 1000, 10000]
+    key = os.urandom(16)
+
+    try:
+        import numpy
+        backends = ["xxtea", "numpy"]
+    except ImportError:
+        backends = ["xxtea"]
+
+    print(f"block size: {block_size} bytes")
+    for count in batches:
+        blocks = [os.urandom(block_size) for _ in range(count)]
+
+        elapsed = best_of(3, lambda: [Decryption(key, bytes=block) for block in blocks])
+        print(f"{count:>6} blocks, one Decryption per block : {count / elapsed:>12,.0f} blocks/s")
+
+        for backend in backends:
+            elapsed = best_of(3, lambda: decrypt_blocks(blocks, key, backend))
+            print(f"{count:>6} blocks, decrypt_blocks({backend:>5})    : {count / elapsed:>12,.0f} blocks/s")
+
+if __name__ == '__main__':
+    main()
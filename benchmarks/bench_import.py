@@ -0,0 +1,54 @@
+# Benchmark: `import lunii` cost
+#
+# Measures the import time of the package in fresh interpreters, and fails
+# (exit status 1) if it goes over budget or if a heavy dependency that should
+# only be loaded on use (vlc, PIL, climage, requests, pkg_resources) got imported.
+#
+# Usage: python -m benchmarks.bench_import [budget_ms] [repeat]
+
+import os
+import re
+import sys
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+LAZY_MODULES = ('vlc', 'PIL', 'climage', 'requests', 'pkg_resources')
+
+PROBE = (
+    "import sys; import lunii; "
+    f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+)
+
+def import_time_us():
+    # -X importtime reports the cumulative time of every top-level import
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import lunii'],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| lunii$', line)
+        if match:
+            return int(match.group(1))
+    raise RuntimeError("lunii import time not found in -X importtime output")
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    best = min(import_time_us() for _ in range(repeat)) / 1000
+
+    loaded = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout.strip()
+
+    print(f"import lunii     : {best:.1f} ms (budget {budget_ms:.1f} ms)")
+    print(f"lazy deps loaded : {loaded or 'none'}")
+
+    if loaded or best > budget_ms:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Benchmark: memory held by the stage nodes of a large pack
+#
+# Builds a synthetic pack, then measures with tracemalloc the memory held once
+# every node, its transitions and control settings are materialized:
+#   - the former representation: plain objects with a __dict__, lists of
+#     Transition objects and a ControlSettings object holding 5 booleans
+#   - the current one: __slots__ views over the NodeTable columns, transitions
+#     as (start, count) ranges and controls packed in a bitfield
+#
+# Both builds keep every object they create (nodes, transitions, controls) alive
+# until measured. The pack has 2 * options + 1 nodes, and story nodes go back to
+# at most `fan_out` menu choices.
+#
+# Usage: python -m benchmarks.bench_node_memory [options] [fan_out]
+
+import sys
+import shutil
+import tempfile
+import tracemalloc
+
+from lunii import Device
+from lunii.synthetic import make_device
+
+class LegacyTransition:
+    def __init__(self, to_index):
+        self.to_index = to_index
+
+class LegacyControlSettings:
+    def __init__(self, dict_controls):
+        self.wheel = dict_controls.get('wheel', False)
+        self.ok = dict_controls.get('ok', False)
+        self.home = dict_controls.get('home', False)
+        self.pause = dict_controls.get('pause', False)
+        self.autoplay = dict_controls.get('autoplay', False)
+
+class LegacyStageNode:
+    def __init__(self, index, assets, next_transitions, home_transitions, control_settings):
+        self.index = index
+        self.assets = assets
+        self.next_transitions = next_transitions
+        self.home_transitions = home_transitions
+        self.control_settings = control_settings
+
+def build_legacy(story):
+    nodes = {}
+    for index, node in story.stage_nodes.items():
+        controls = node.control_settings
+        nodes[index] = LegacyStageNode(
+            index,
+            {'image': None, 'audio': None},
+            [LegacyTransition(t.to_index) for t in node.next_transitions],
+            [LegacyTransition(t.to_index) for t in node.home_transitions],
+            LegacyControlSettings({
+                'wheel': controls.wheel, 'ok': controls.ok, 'home': controls.home,
+                'pause': controls.pause, 'autoplay': controls.autoplay,
+            }),
+        )
+    return nodes
+
+def build_current(story):
+    # transitions and controls are built on access, keep them along their node
+    nodes = {}
+    for index, node in story.stage_nodes.items():
+        nodes[index] = (node, node.next_transitions, node.home_transitions, node.control_settings)
+    return nodes
+
+def measure(fn, *args):
+    tracemalloc.start()
+    result = fn(*args)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, result
+
+def main():
+    options = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    fan_out = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    root = tempfile.mkdtemp(prefix='lunii-bench-')
+    try:
+        make_device(root, packs=1, options=options, image_size=(8, 8), audio_size=16, fan_out=fan_out)
+
+        device = Device(root, asset_cache_size=0, story_cache=False)
+        tracemalloc.start()
+        device.parse_stories()
+        parsed, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        story = device.stories[0]
+        current, _ = measure(build_current, story)
+
+        # a freshly parsed story, so the legacy build doesn't count memoized views
+        device.parse_stories()
+        legacy, _ = measure(build_legacy, device.stories[0])
+
+        count = len(story.stage_nodes)
+        print(f"nodes                         : {count}")
+        print(f"parsed story (node table ...) : {parsed / 1e6:8.2f} MB")
+        print(f"legacy node objects           : {legacy / 1e6:8.2f} MB ({legacy / count:.0f} B/node)")
+        print(f"slotted node views            : {current / 1e6:8.2f} MB ({current / count:.0f} B/node)")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
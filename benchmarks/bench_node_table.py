@@ -0,0 +1,61 @@
+# Benchmark: decoding of the ni stage-node table
+#
+# Compares the former record-by-record parser (one seek/read, one ByteBuffer
+# and one struct.unpack_from per field) with the single-pass NodeTable.
+#
+# Usage: python -m benchmarks.bench_node_table [nodes] [repeat]
+
+import io
+import sys
+import struct
+
+from lunii.bench import best_of
+from lunii.utils import ByteBuffer, NodeTable
+
+def make_ni(count):
+    header = struct.pack('<hhiiiiiB', 1, 1, 0x200, 0x2C, count, count, count, 0).ljust(0x200, b'\0')
+    nodes = b''.join(
+        struct.pack('<8i5h', i, i, i, 1, 0, -1, -1, -1, 1, 1, 0, 0, i & 1) + b'\0\0'
+        for i in range(count)
+    )
+    return header + nodes
+
+def legacy_parse(data):
+    fp_ni = io.BytesIO(data)
+    bb = ByteBuffer(fp_ni.read(), '<')
+    bb.get_short()
+    bb.get_short()
+    bb.get_int()
+    node_size = bb.get_int()
+    stage_nodes_count = bb.get_int()
+
+    rows = []
+    for i in range(stage_nodes_count):
+        fp_ni.seek(0x200 + (i * node_size))
+        bb = ByteBuffer(fp_ni.read(node_size), '<')
+        ints = [bb.get_int() for _ in range(8)]
+        controls = {
+            'wheel': bb.get_short() != 0,
+            'ok': bb.get_short() != 0,
+            'home': bb.get_short() != 0,
+            'pause': bb.get_short() != 0,
+            'autoplay': bb.get_short() != 0
+        }
+        rows.append((ints, controls))
+    return rows
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    data = make_ni(count)
+
+    before = best_of(repeat, lambda: legacy_parse(data))
+    after = best_of(repeat, lambda: NodeTable(data))
+
+    print(f"nodes: {count}")
+    print(f"record-by-record : {count / before:>14,.0f} nodes/s ({before * 1000:.2f} ms)")
+    print(f"NodeTable        : {count / after:>14,.0f} nodes/s ({after * 1000:.2f} ms)")
+    print(f"speedup          : {before / after:.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from . import utils
 from .story import Story
 from .device import Device
-from .player import StoryPlayer
+from .player import StoryPlayer, AsyncStoryPlayer
+from .simulator import PlaythroughSimulator
 
@@ -0,0 +1,149 @@
+# Benchmark suite, run against synthetic devices
+#
+# Usage: python -m lunii.bench [--packs 10 100 1000] [--repeat 3] [--json]
+#
+# Every measure keeps the best of `repeat` runs, on a device generated once per size.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from itertools import chain
+from collections import deque
+
+from .device import Device
+from .cache import StoryCache
+from .utils import Decryption
+from .simulator import PlaythroughSimulator
+from .synthetic import GENERIC_KEY, make_device
+
+def best_of(repeat, fn):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_hw_info(path, repeat):
+    elapsed = best_of(repeat, lambda: Device(path, asset_cache_size=0, story_cache=False))
+    return {'ms': elapsed * 1000}
+
+def bench_parse_stories(path, repeat, packs):
+    device = Device(path, asset_cache_size=0, story_cache=False)
+    elapsed = best_of(repeat, device.parse_stories)
+    return {'ms': elapsed * 1000, 'stories_per_s': packs / elapsed}
+
+def bench_parse_stories_cached(path, repeat, packs, cache_path):
+    device = Device(path, asset_cache_size=0, story_cache=StoryCache(cache_path))
+    # first scan fills the cache
+    device.parse_stories()
+    elapsed = best_of(repeat, device.parse_stories)
+    return {'ms': elapsed * 1000, 'stories_per_s': packs / elapsed}
+
+def bench_decryption(path, repeat, max_files=1000):
+    files = []
+    for root, _, names in os.walk(os.path.join(path, '.content')):
+        if os.path.basename(os.path.dirname(root)) == 'rf':
+            files.extend(os.path.join(root, name) for name in names)
+    files = files[:max_files]
+    size = sum(os.path.getsize(file) for file in files)
+
+    def decrypt_all():
+        for file in files:
+            Decryption(GENERIC_KEY, path=file)
+
+    elapsed = best_of(repeat, decrypt_all)
+    return {'files': len(files), 'files_per_s': len(files) / elapsed, 'mb_per_s': size / elapsed / 1e6}
+
+def bench_traversal(path, repeat):
+    device = Device(path, asset_cache_size=0, story_cache=False)
+    device.parse_stories()
+    visited_total = 0
+
+    def traverse():
+        nonlocal visited_total
+        visited_total = 0
+        for story in device.stories:
+            # breadth first walk of every transition, from the cover node
+            seen, queue = {0}, deque([0])
+            while queue:
+                node = story.stage_nodes[queue.popleft()]
+                for transition in chain(node.next_transitions, node.home_transitions):
+                    if transition.to_index not in seen:
+                        seen.add(transition.to_index)
+                        queue.append(transition.to_index)
+            visited_total += len(seen)
+
+    elapsed = best_of(repeat, traverse)
+    return {'nodes': visited_total, 'nodes_per_s': visited_total / elapsed}
+
+def bench_simulation(path, repeat, runs=100):
+    device = Device(path, asset_cache_size=0, story_cache=False)
+    device.parse_stories()
+    simulators = [PlaythroughSimulator(story, max_steps=100) for story in device.stories]
+
+    def simulate():
+        for simulator in simulators:
+            simulator.simulate(runs=runs)
+
+    elapsed = best_of(repeat, simulate)
+    total = runs * len(simulators)
+    return {'runs': total, 'runs_per_s': total / elapsed}
+
+def run(packs_sizes=(10, 100, 1000), repeat=3, options=4, workdir=None):
+    results = []
+    root = workdir or tempfile.mkdtemp(prefix='lunii-bench-')
+    try:
+        for packs in packs_sizes:
+            path = os.path.join(root, f'device-{packs}')
+            if not os.path.exists(os.path.join(path, '.pi')):
+                make_device(path, packs=packs, options=options)
+
+            results.append({
+                'packs': packs,
+                'hw_info': bench_hw_info(path, repeat),
+                'parse_stories': bench_parse_stories(path, repeat, packs),
+                'parse_stories_cached': bench_parse_stories_cached(path, repeat, packs, os.path.join(root, f'cache-{packs}')),
+                'decryption': bench_decryption(path, repeat),
+                'traversal': bench_traversal(path, repeat),
+                'simulation': bench_simulation(path, repeat),
+            })
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+def print_results(results, file=sys.stdout):
+    for result in results:
+        print(f"-- {result['packs']} packs", file=file)
+        print(f"hw info              : {result['hw_info']['ms']:10.2f} ms", file=file)
+        print(f"parse stories        : {result['parse_stories']['ms']:10.2f} ms "
+              f"({result['parse_stories']['stories_per_s']:,.0f} stories/s)", file=file)
+        print(f"parse stories cached : {result['parse_stories_cached']['ms']:10.2f} ms "
+              f"({result['parse_stories_cached']['stories_per_s']:,.0f} stories/s)", file=file)
+        print(f"decryption           : {result['decryption']['files_per_s']:10,.0f} files/s "
+              f"({result['decryption']['mb_per_s']:.1f} MB/s)", file=file)
+        print(f"traversal            : {result['traversal']['nodes_per_s']:10,.0f} nodes/s", file=file)
+        print(f"simulation           : {result['simulation']['runs_per_s']:10,.0f} playthroughs/s", file=file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks lunii against synthetic devices")
+    parser.add_argument('--packs', type=int, nargs='+', default=[10, 100, 1000], help="device sizes, in packs")
+    parser.add_argument('--options', type=int, default=4, help="menu options per pack")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', help="keeps the generated devices in this folder, and reuses them")
+    parser.add_argument('--json', action='store_true', help="prints results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.packs, args.repeat, args.options, args.workdir)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+if __name__ == '__main__':
+    main()
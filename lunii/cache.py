@@ -0,0 +1,138 @@
+import os
+import pickle
+import hashlib
+import threading
+from uuid import UUID
+
+from appdirs import AppDirs
+
+# bump whenever the cached story state changes shape
+CACHE_FORMAT = 2
+
+# files a parsed story depends on, in its .content/<id>/ folder
+STORY_FILES = ('ni', 'li', 'ri', 'si', 'bt', 'nm')
+
+def file_fingerprint(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def story_fingerprint(story_path: str, device_key: bytes) -> tuple:
+    """
+    Fingerprint of a story folder: size and mtime of every file it is parsed from.
+    The device key is part of it, since the authorization depends on it.
+    """
+    return (
+        hashlib.sha1(device_key).hexdigest()[:16],
+        tuple(file_fingerprint(os.path.join(story_path, file)) for file in STORY_FILES),
+    )
+
+def cache_disabled() -> bool:
+    return os.environ.get('LUNII_NO_CACHE', '') not in ('', '0')
+
+class StoryCache:
+    """
+    Parsed stories persisted on disk, one file per story UUID.
+    An entry is only used if the story files fingerprint didn't change.
+    prune() removes the least recently used entries once the cache exceeds max_bytes.
+    The cache is best effort: I/O errors are treated as misses, never raised.
+    """
+    def __init__(self, path: str | None = None, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path or os.path.join(AppDirs("lunii", "lunii").user_cache_dir, "stories")
+        self.max_bytes = max_bytes
+
+    def __entry_path(self, uuid: UUID) -> str:
+        return os.path.join(self.path, uuid.hex + '.pickle')
+
+    def get(self, uuid: UUID, fingerprint: tuple) -> dict | None:
+        entry_path = self.__entry_path(uuid)
+        try:
+            with open(entry_path, 'rb') as fp:
+                entry = pickle.load(fp)
+        except OSError:
+            # missing entry, or unreadable cache folder
+            return None
+        except Exception:
+            # corrupted or written by an incompatible version
+            self.invalidate(uuid)
+            return None
+
+        if entry.get('format') != CACHE_FORMAT or entry.get('fingerprint') != fingerprint:
+            return None
+
+        # mtime tracks recent use, for eviction
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return entry['state']
+
+    def put(self, uuid: UUID, fingerprint: tuple, state: dict):
+        entry_path = self.__entry_path(uuid)
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        entry = {'format': CACHE_FORMAT, 'fingerprint': fingerprint, 'state': state}
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp_path, 'wb') as fp:
+                pickle.dump(entry, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            # atomic, concurrent scans never read a partial entry
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            # read-only or full disk, the story just won't be cached
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def invalidate(self, uuid: UUID | None = None):
+        """
+        Removes the entry of a story, or every entry if no UUID is given
+        """
+        if uuid is not None:
+            paths = [self.__entry_path(uuid)]
+        elif os.path.isdir(self.path):
+            paths = [os.path.join(self.path, name) for name in os.listdir(self.path)]
+        else:
+            paths = []
+
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def prune(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes.
+        Scans the cache folder once, so it is run once per device scan rather than on every put().
+        """
+        entries = []
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if not entry.name.endswith('.pickle'):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        # replaced or removed meanwhile by another worker
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
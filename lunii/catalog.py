@@ -0,0 +1,267 @@
+import os
+import time
+import sqlite3
+from uuid import UUID
+
+from appdirs import AppDirs
+
+from .utils import StoryMetadata, normalize_uuid
+
+# bump whenever the schema changes, older catalogs are rebuilt
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    snu INTEGER PRIMARY KEY,
+    fw_major INTEGER,
+    fw_minor INTEGER,
+    mountpoint TEXT,
+    scanned_at REAL
+);
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY,
+    snu INTEGER NOT NULL REFERENCES devices(snu) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    uuid TEXT NOT NULL,
+    short_uuid TEXT NOT NULL,
+    title TEXT,
+    version INTEGER,
+    night_mode INTEGER,
+    authorized INTEGER,
+    nodes_count INTEGER,
+    error TEXT,
+    UNIQUE (snu, uuid)
+);
+CREATE INDEX IF NOT EXISTS stories_uuid ON stories(uuid);
+CREATE INDEX IF NOT EXISTS stories_short_uuid ON stories(short_uuid);
+CREATE TABLE IF NOT EXISTS nodes (
+    story_id INTEGER NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    ri_index INTEGER,
+    si_index INTEGER,
+    next_start INTEGER,
+    next_count INTEGER,
+    home_start INTEGER,
+    home_count INTEGER,
+    controls INTEGER,
+    PRIMARY KEY (story_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS assets (
+    story_id INTEGER NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (story_id, kind, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS story_titles (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL UNIQUE
+);
+-- rowid of a titles row is the id of its story_titles row
+CREATE VIRTUAL TABLE IF NOT EXISTS titles USING fts5(title, subtitle, keywords);
+"""
+
+class Catalog:
+    """
+    Contents of many devices persisted in a SQLite database: devices, their stories,
+    the stories nodes and asset paths, and a full-text index (FTS5) over the titles,
+    subtitles and keywords of the stories, from StoryMetadata.
+
+    Queries never touch the devices, so they answer in milliseconds whatever the number of dumps.
+    """
+    def __init__(self, path: str | None = None, metadata: StoryMetadata | None = None):
+        self.path = path or os.path.join(AppDirs("lunii", "lunii").user_data_dir, "catalog.sqlite")
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.metadata = metadata
+
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.__migrate()
+
+    def __migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            # the catalog is a cache of the devices, it is simply rebuilt
+            for table in ('titles', 'story_titles', 'assets', 'nodes', 'stories', 'devices'):
+                self.db.execute(f"DROP TABLE IF EXISTS {table}")
+        with self.db:
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def add_device(self, device, nodes: bool = True):
+        """
+        Stores a device and its stories, replacing what was known of it.
+        Stories keep their .pi position, a story listed twice is stored once, at its first one.
+        Stories that failed to parse are stored too, with their error and no details.
+        Titles are updated from the metadata on every call.
+        With nodes=False, stories are only read header-only (Device.list_stories())
+        and their nodes and assets aren't stored.
+        Stories are parsed if they weren't already.
+        Returns the errors of the stories that failed to parse, keyed by UUID.
+        """
+        if nodes:
+            if not device.stories:
+                device.parse_stories()
+            stories, errors = device.stories, device.parse_errors
+        else:
+            stories, errors = device.list_stories(), device.list_errors
+        stories = {story.full_uuid: story for story in stories}
+        metadata = self.metadata or StoryMetadata()
+
+        with self.db:
+            self.db.execute("DELETE FROM devices WHERE snu = ?", (device.snu,))
+            self.db.execute(
+                "INSERT INTO devices (snu, fw_major, fw_minor, mountpoint, scanned_at) VALUES (?, ?, ?, ?, ?)",
+                (device.snu, device.fw_vers_major, device.fw_vers_minor, device.mountpoint, time.time()),
+            )
+
+            seen = set()
+            for position, uuid in enumerate(device.story_list):
+                if uuid in seen:
+                    continue
+                seen.add(uuid)
+                story = stories.get(uuid)
+                if story is None:
+                    # on the device all the same, devices_with() must know it
+                    error = errors.get(uuid)
+                    self.db.execute(
+                        "INSERT INTO stories (snu, position, uuid, short_uuid, title, error) VALUES (?, ?, ?, ?, ?, ?)",
+                        (device.snu, position, str(uuid), uuid.hex[-8:].upper(),
+                         metadata.get_metadata(uuid).get('title'), str(error) if error is not None else "not parsed"),
+                    )
+                    self.__index_title(str(uuid), metadata)
+                    continue
+
+                story_id = self.db.execute(
+                    "INSERT INTO stories (snu, position, uuid, short_uuid, title, version, night_mode, authorized, nodes_count)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (device.snu, position, str(uuid), story.uuid, story.title, story.version,
+                     story.night_mode, story.authorized, story.nodes_count),
+                ).lastrowid
+                self.__index_title(str(uuid), metadata)
+                if nodes:
+                    self.__add_nodes(story_id, story)
+
+        return dict(errors)
+
+    def __add_nodes(self, story_id, story):
+        table, stage_nodes = story.node_table, story.stage_nodes
+        rows = []
+        for i in range(len(table)):
+            next_range, home_range = stage_nodes.next_transitions(i), stage_nodes.home_transitions(i)
+            rows.append((story_id, i, table.ri_index[i], table.si_index[i],
+                         next_range.start, len(next_range), home_range.start, len(home_range), table.controls[i]))
+        self.db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        # paths are stored relative to the story folder
+        prefix = f"{story.mountpoint}/.content/{story.uuid}/"
+        self.db.executemany("INSERT INTO assets VALUES (?, ?, ?, ?)", (
+            (story_id, kind, idx, path[len(prefix):] if path.startswith(prefix) else path)
+            for kind, paths in story.asset_paths().items()
+            for idx, path in enumerate(paths)
+        ))
+
+    def __index_title(self, uuid, metadata):
+        entry = metadata.get_metadata(uuid)
+        values = (entry.get('title', ''), entry.get('subtitle', ''), (entry.get('keywords') or '').replace(',', ' '))
+
+        row = self.db.execute("SELECT id FROM story_titles WHERE uuid = ?", (uuid,)).fetchone()
+        if row is None:
+            title_id = self.db.execute("INSERT INTO story_titles (uuid) VALUES (?)", (uuid,)).lastrowid
+            self.db.execute("INSERT INTO titles (rowid, title, subtitle, keywords) VALUES (?, ?, ?, ?)",
+                            (title_id, *values))
+            return
+
+        # the full-text index is only rewritten if the titles changed
+        current = self.db.execute("SELECT title, subtitle, keywords FROM titles WHERE rowid = ?", (row['id'],)).fetchone()
+        if current is None or tuple(current) != values:
+            self.db.execute("DELETE FROM titles WHERE rowid = ?", (row['id'],))
+            self.db.execute("INSERT INTO titles (rowid, title, subtitle, keywords) VALUES (?, ?, ?, ?)",
+                            (row['id'], *values))
+
+    def remove_device(self, snu: int):
+        with self.db:
+            self.db.execute("DELETE FROM devices WHERE snu = ?", (snu,))
+            # titles of stories no device has anymore
+            orphans = "SELECT id FROM story_titles WHERE uuid NOT IN (SELECT uuid FROM stories)"
+            self.db.execute(f"DELETE FROM titles WHERE rowid IN ({orphans})")
+            self.db.execute(f"DELETE FROM story_titles WHERE id IN ({orphans})")
+
+    def devices(self) -> list:
+        return [dict(row) for row in self.db.execute("SELECT * FROM devices ORDER BY snu")]
+
+    def stories(self, snu: int | None = None) -> list:
+        if snu is None:
+            rows = self.db.execute("SELECT * FROM stories ORDER BY snu, position")
+        else:
+            rows = self.db.execute("SELECT * FROM stories WHERE snu = ? ORDER BY position", (snu,))
+        return [self.__story(row) for row in rows]
+
+    def devices_with(self, uuid) -> list:
+        """
+        Devices having a story, by full or short (8 hex chars) UUID
+        """
+        key = normalize_uuid(uuid)
+        if len(key) == 32:
+            where, value = "s.uuid = ?", str(UUID(key))
+        else:
+            where, value = "s.short_uuid = ?", key.upper()
+        rows = self.db.execute(
+            f"SELECT d.* FROM devices d JOIN stories s ON s.snu = d.snu WHERE {where} ORDER BY d.snu", (value,))
+        return [dict(row) for row in rows]
+
+    def search(self, query: str, limit: int = 50) -> list:
+        """
+        Stories matching a full-text query (FTS5 syntax, e.g. 'pirate', 'keywords:noël',
+        'title:"petit prince"'), best matches first, with the devices having them.
+        """
+        rows = self.db.execute(
+            "SELECT t.uuid, f.title, f.subtitle, f.keywords FROM titles f JOIN story_titles t ON t.id = f.rowid"
+            " WHERE titles MATCH ? ORDER BY f.rank LIMIT ?",
+            (query, limit),
+        ).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result['devices'] = [snu for snu, in self.db.execute(
+                "SELECT snu FROM stories WHERE uuid = ? ORDER BY snu", (row['uuid'],))]
+            results.append(result)
+        return results
+
+    def nodes(self, snu: int, uuid) -> list:
+        """
+        Nodes of a story on a device, with their image and audio paths
+        """
+        rows = self.db.execute("""
+            SELECT n.idx, n.next_start, n.next_count, n.home_start, n.home_count, n.controls,
+                   image.path AS image, audio.path AS audio
+            FROM stories s
+            JOIN nodes n ON n.story_id = s.id
+            LEFT JOIN assets image ON image.story_id = s.id AND image.kind = 'image' AND image.idx = n.ri_index
+            LEFT JOIN assets audio ON audio.story_id = s.id AND audio.kind = 'audio' AND audio.idx = n.si_index
+            WHERE s.snu = ? AND s.uuid = ?
+            ORDER BY n.idx
+        """, (snu, str(UUID(normalize_uuid(uuid)))))
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def __story(row) -> dict:
+        story = dict(row)
+        # unknown for stories that failed to parse
+        for key in ('night_mode', 'authorized'):
+            if story[key] is not None:
+                story[key] = bool(story[key])
+        return story
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,35 +1,171 @@
-# cli for lumiios
-# WIP-- TODO later
+# cli for lunii
+#
+# Usage: lunii [--json] [--trace FILE] <command> ...
+#
+#   info PATH                    device serial number, firmware and story count
+#   ls PATH                      stories, read header-only
+#   verify PATH                  files, structure and authorization of every story
+#   export PATH OUTPUT           deciphered backup of the device (or of one story)
+#   bench ...                    benchmarks against synthetic devices (see lunii.bench)
+#
+# Read-only commands only read the files they need, and never load vlc, PIL or climage.
 
-# Path: lumiios/cli.py
-
-import argparse
-import logging
-import os
 import sys
-from pathlib import Path
+import json
+import argparse
+
+from . import Device
+from .instrument import instrument
+
+VERSION = "0.2.1a1"
+
+def _print_json(data):
+    json.dump(data, sys.stdout, indent=2, ensure_ascii=False, default=str)
+    print()
+
+def _open_device(args):
+    # nothing is cached on disk for one-shot commands, header reads are cheaper than cache lookups
+    return Device(args.path, story_cache=False)
+
+def cmd_info(args):
+    device = _open_device(args)
+    info = {
+        'path': device.mountpoint,
+        'snu': device.snu,
+        'firmware': f"{device.fw_vers_major}.{device.fw_vers_minor}",
+        'stories': len(device.story_list),
+    }
+    if args.json:
+        _print_json(info)
+    else:
+        for key, value in info.items():
+            print(f"{key:<9}: {value}")
+    return 0
+
+def cmd_ls(args):
+    device = _open_device(args)
+    stories = [{
+        'uuid': str(story.full_uuid),
+        'title': story.title,
+        'version': story.version,
+        'nodes': story.nodes_count,
+        'night_mode': story.night_mode,
+        'authorized': story.authorized,
+    } for story in device.list_stories()]
+    errors = {str(uuid): str(error) for uuid, error in device.list_errors.items()}
+
+    if args.json:
+        _print_json({'stories': stories, 'errors': errors})
+    else:
+        for story in stories:
+            flags = ('N' if story['night_mode'] else '-') + ('A' if story['authorized'] else '-')
+            print(f"{story['uuid'][-8:].upper()}  {flags}  v{story['version']:<3} {story['nodes']:>5} nodes  {story['title']}")
+        for uuid, error in errors.items():
+            print(f"{uuid[-8:].upper()}  unreadable: {error}", file=sys.stderr)
+    return 1 if errors else 0
+
+def cmd_verify(args):
+    device = _open_device(args)
+    results = device.verify_all(workers=args.workers)
+    failed = [uuid for uuid, result in results.items() if result['status'] != 'authorized']
 
-from . import Device, Story, utils
+    if args.json:
+        _print_json({str(uuid): result for uuid, result in results.items()})
+    else:
+        for uuid, result in results.items():
+            details = ', '.join([f"missing {name}" for name in result['missing']] + result['problems'])
+            print(f"{uuid.hex[-8:].upper()}  {result['status']:<12} {details}")
+        print(f"{len(results) - len(failed)}/{len(results)} stories authorized")
+    return 1 if failed else 0
 
-logger = logging.getLogger(__name__)
+def cmd_export(args):
+    device = Device(args.path, asset_cache_size=0, story_cache=False)
+
+    if args.story:
+        uuid = next((uuid for uuid in device.story_list
+                     if str(uuid) == args.story.lower() or uuid.hex[-8:].upper() == args.story.upper()), None)
+        if uuid is None:
+            print(f"No story {args.story} on this device", file=sys.stderr)
+            return 2
+        device.parse_story(uuid).export(args.output, args.format, args.workers)
+        errors = {}
+    else:
+        def on_progress(done, total, uuid, error):
+            if not args.json:
+                print(f"{done}/{total} {uuid} {'failed: ' + str(error) if error else 'ok'}", file=sys.stderr)
+        errors = device.export(args.output, args.format, args.workers, on_progress)
+
+    if args.json:
+        _print_json({'output': args.output, 'errors': {str(uuid): str(error) for uuid, error in errors.items()}})
+    return 1 if errors else 0
+
+def cmd_bench(args):
+    # imported here, it pulls the synthetic devices generator in
+    from . import bench
+    bench.main(args.bench_args + (['--json'] if args.json else []))
+    return 0
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--json', action='store_true', default=argparse.SUPPRESS, help="prints results as JSON")
+    common.add_argument('--trace', metavar='FILE', default=argparse.SUPPRESS,
+                        help="writes timings and I/O counters of the command to FILE, as JSON")
 
-def main():
     parser = argparse.ArgumentParser(
+        prog='lunii',
         description="A Python package for working with Lunii devices, and emulating them",
         epilog="For more information, visit github.com/bastien8060/lumiios",
+        parents=[common],
     )
-    
-    parser.add_argument(
-        "-v",
-        "--version",
-        action="version",
-        version="%(prog)s 0.1.0a1",
-    )
+    parser.add_argument('-v', '--version', action='version', version=f"%(prog)s {VERSION}")
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    info = commands.add_parser('info', parents=[common], help="device serial number, firmware and story count")
+    info.add_argument('path', help="mountpoint or dump of the device")
+    info.set_defaults(func=cmd_info)
+
+    ls = commands.add_parser('ls', parents=[common], help="lists the stories (header-only)")
+    ls.add_argument('path', help="mountpoint or dump of the device")
+    ls.set_defaults(func=cmd_ls)
+
+    verify = commands.add_parser('verify', parents=[common], help="checks files and authorization of every story")
+    verify.add_argument('path', help="mountpoint or dump of the device")
+    verify.add_argument('--workers', type=int, default=4)
+    verify.set_defaults(func=cmd_verify)
+
+    export = commands.add_parser('export', parents=[common], help="deciphered backup of the device, or of one story")
+    export.add_argument('path', help="mountpoint or dump of the device")
+    export.add_argument('output', help="zip archive or folder to write")
+    export.add_argument('--format', choices=('zip', 'dir'), default='zip')
+    export.add_argument('--story', help="only exports this story (full or short UUID)")
+    export.add_argument('--workers', type=int, default=4, help="concurrent writes, folder exports only")
+    export.set_defaults(func=cmd_export)
+
+    # other arguments are passed to lunii.bench, e.g. --packs 10 100
+    bench = commands.add_parser('bench', parents=[common], help="benchmarks against synthetic devices")
+    bench.set_defaults(func=cmd_bench)
 
-    args = parser.parse_args()
+    return parser
 
-    if args.version:
-        print("lumiios 0.1.0a1")
-        sys.exit(0)
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and args.command != 'bench':
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.bench_args = extra
+    # --json and --trace can be given before or after the command
+    args.json = getattr(args, 'json', False)
+    args.trace = getattr(args, 'trace', None)
+    try:
+        if args.trace is None:
+            return args.func(args)
+        with instrument() as recorder:
+            status = args.func(args)
+        recorder.dump(args.trace)
+        return status
+    except (OSError, ValueError) as e:
+        print(f"lunii: {e}", file=sys.stderr)
+        return 2
 
- 
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import os
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# kinds of asset folders in .content/<id>/, indexed separately:
+# rf/ files are deciphered when loaded, sf/ files aren't
+ASSET_FOLDERS = ('rf', 'sf')
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> bytes:
+    # blake2b is the fastest hash of hashlib, and releases the GIL on large buffers
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fp:
+        while chunk := fp.read(chunk_size):
+            digest.update(chunk)
+    return digest.digest()
+
+class AssetIndex:
+    """
+    Content index of the rf/ and sf/ files of a set of story folders.
+
+    Files are grouped by size first, and only files sharing a size with another one
+    are hashed. Identical files get the same key, derived from their content,
+    to be used as their cache key: they are then read and deciphered only once.
+
+    The size and mtime of every indexed file are kept: a file changed since it was
+    hashed leaves its group and gets its own path as key again.
+    """
+    def __init__(self):
+        # path -> key, only for files having duplicates
+        self.keys = {}
+        # key -> paths of the identical files
+        self.groups = {}
+        # path -> (size, mtime_ns) when it was hashed
+        self.stats = {}
+        self.files = 0
+        self.bytes = 0
+        self.sizes = {}
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def build(cls, story_paths, workers: int = 4):
+        """
+        Indexes the assets of the given .content/<id>/ folders, hashing in a thread pool
+        """
+        index = cls()
+        by_size = defaultdict(list)
+        for story_path in story_paths:
+            for kind in ASSET_FOLDERS:
+                for root, _, names in os.walk(os.path.join(story_path, kind)):
+                    for name in sorted(names):
+                        path = os.path.join(root, name).replace(os.sep, '/')
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        by_size[(kind, st.st_size)].append(path)
+                        index.stats[path] = (st.st_size, st.st_mtime_ns)
+                        index.files += 1
+                        index.bytes += st.st_size
+
+        candidates = [(kind_size, path) for kind_size, paths in by_size.items() if len(paths) > 1 for path in paths]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            digests = pool.map(lambda candidate: file_digest(candidate[1]), candidates)
+            by_content = defaultdict(list)
+            for (kind_size, path), digest in zip(candidates, digests):
+                by_content[(kind_size, digest)].append(path)
+
+        for ((kind, size), digest), paths in by_content.items():
+            if len(paths) > 1:
+                # never a path, so a file leaving its group can't collide with it
+                key = f"{kind}:{size}:{digest.hex()}"
+                index.groups[key] = paths
+                index.sizes[key] = size
+                for path in paths:
+                    index.keys[path] = key
+        # only the stats of the grouped files are checked afterwards
+        index.stats = {path: index.stats[path] for path in index.keys}
+        return index
+
+    def key(self, path: str) -> str:
+        """
+        Cache key of an asset: its own path, unless it is a copy of other files
+        and didn't change since it was indexed
+        """
+        key = self.keys.get(path)
+        if key is None:
+            return path
+        if self.__stat(path) != self.stats.get(path):
+            self.__drop(path)
+            return path
+        return key
+
+    def revalidate(self) -> dict:
+        """
+        Checks the size and mtime of every grouped file, and drops the ones that changed.
+        Returns the keys the dropped paths had, by path.
+        """
+        stale = {path: key for path, key in list(self.keys.items()) if self.__stat(path) != self.stats.get(path)}
+        for path in stale:
+            self.__drop(path)
+        return stale
+
+    def folders(self) -> set:
+        """
+        Folders holding grouped files, to watch for in-place changes
+        """
+        return {os.path.dirname(path) for path in self.keys}
+
+    @staticmethod
+    def __stat(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def __drop(self, path: str):
+        with self.__lock:
+            key = self.keys.pop(path, None)
+            if key is None:
+                return
+            self.stats.pop(path, None)
+            paths = self.groups[key]
+            paths.remove(path)
+            if len(paths) < 2:
+                # a single file left, it isn't a duplicate anymore
+                for other in paths:
+                    self.keys.pop(other, None)
+                    self.stats.pop(other, None)
+                del self.groups[key]
+                del self.sizes[key]
+
+    def duplicates(self) -> list:
+        """
+        Groups of identical files, as (size, paths) tuples, by decreasing bytes wasted
+        """
+        groups = [(self.sizes[key], paths) for key, paths in self.groups.items()]
+        groups.sort(key=lambda group: group[0] * (len(group[1]) - 1), reverse=True)
+        return groups
+
+    def report(self, top: int = 10) -> dict:
+        duplicate_files = sum(len(paths) - 1 for paths in self.groups.values())
+        duplicate_bytes = sum(self.sizes[key] * (len(paths) - 1) for key, paths in self.groups.items())
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'unique_files': self.files - duplicate_files,
+            'unique_bytes': self.bytes - duplicate_bytes,
+            'duplicate_files': duplicate_files,
+            'duplicate_bytes': duplicate_bytes,
+            'largest_duplicates': [
+                {'size': size, 'copies': len(paths), 'paths': paths} for size, paths in self.duplicates()[:top]
+            ],
+        }
@@ -1,32 +1,311 @@
+import threading
 from uuid import UUID
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 from . import Story
-from .utils import Decryption, ByteBuffer
+from .utils import Decryption, AssetCache, decrypt_blocks
+from .cache import StoryCache, cache_disabled, file_fingerprint, story_fingerprint
+from .watch import InotifyWatcher
+from .dedup import AssetIndex
+from .verify import verify_story, verification_fingerprint
+from . import instrument
+from .instrument import span
+from .export import open_writer, dump_json
+
+# external flash hardcoded value
+# 91BD7A0A A75440A9 BBD49D6C E0DCC0E3
+RAW_KEY_GENERIC = [0x91BD7A0A, 0xA75440A9, 0xBBD49D6C, 0xE0DCC0E3]
+
+def _parse_story(mountpoint, uuid, keys, asset_cache=None, story_cache=None, asset_index=None):
+    # module level, so it can be pickled for process pools
+    return Story(mountpoint, uuid, keys, asset_cache, story_cache, asset_index)
 
 class Device:
-    def __init__(self, path):
+    def __init__(self, path, asset_cache_size=64 * 1024 * 1024, story_cache=True):
         self.mountpoint = path
         self.devkey = None
         self.devicekey = None
-        self.story_list, stories = [], []
+        self.story_list, self.stories = [], []
+        self.parse_errors, self.list_errors = {}, {}
+        self.__fingerprints = {}
+        # uuid -> (fingerprint, result) of verify_all()
+        self.__verifications = {}
 
-        # external flash hardcoded value
-        # 91BD7A0A A75440A9 BBD49D6C E0DCC0E3
-        self.raw_key_generic = [0x91BD7A0A, 0xA75440A9, 0xBBD49D6C, 0xE0DCC0E3]
+        self.raw_key_generic = RAW_KEY_GENERIC
         self.lunii_generic_key = self.__vectkey_to_bytes(self.raw_key_generic)
 
-        self.__get_hw_info()
-        self.__get_stories()
+        # assets are loaded on demand, and their content is shared across stories
+        # through this cache (bounded in bytes). A size of 0/None disables it.
+        self.asset_cache = AssetCache(asset_cache_size) if asset_cache_size else None
+        # content index of the assets, see index_assets()
+        self.asset_index = None
+
+        # parsed stories are persisted across runs, keyed by their files fingerprint.
+        # story_cache can be True (default location), False, or a StoryCache instance.
+        # Setting LUNII_NO_CACHE=1 disables the default one.
+        if story_cache is True:
+            self.story_cache = None if cache_disabled() else StoryCache()
+        else:
+            self.story_cache = story_cache or None
+
+        with span('device.hw_info'):
+            self.__get_hw_info()
+        with span('device.stories'):
+            self.__get_stories()
 
     def populate(self):
         self.__get_stories()
 
-    def parse_stories(self):
-        self.__parse_stories()
+    def parse_stories(self, workers=1, executor="thread", on_progress=None):
+        """
+        Parses every story listed in .pi into `self.stories`, keeping the .pi order.
+        With workers > 1, stories are parsed concurrently in a thread or process pool.
+        A story failing to parse doesn't abort the scan: it is left out of `self.stories`
+        and its exception is stored in `self.parse_errors`, keyed by UUID.
+        on_progress(done, total, uuid, error) is called after each story.
+        """
+        self.__parse_stories(workers, executor, on_progress)
+
+    def refresh(self, workers=1, executor="thread", on_progress=None):
+        """
+        Rescans the device, only parsing what changed since the last parse_stories()/refresh():
+        .pi is read again, stories no longer listed are dropped, and stories whose
+        .content/<id> folder changed (size and mtime of the folder and of its index files),
+        whose assets shared through index_assets() changed, or that are new are parsed.
+        Others are kept as they are.
+        Returns the {'added': [...], 'changed': [...], 'removed': [...]} UUIDs.
+        """
+        previous = {story.full_uuid: story for story in self.stories}
+        self.__get_stories()
+
+        fingerprints = {uuid: self.__story_fingerprint(uuid) for uuid in self.story_list}
+        added = [uuid for uuid in fingerprints if uuid not in self.__fingerprints]
+        changed = [uuid for uuid in fingerprints
+                   if uuid in self.__fingerprints and fingerprints[uuid] != self.__fingerprints[uuid]]
+        removed = [uuid for uuid in self.__fingerprints if uuid not in fingerprints]
+
+        if self.asset_index is not None:
+            # assets rewritten in place leave the story folder as is, the index tells them apart
+            stale = self.__revalidate_asset_index()
+            changed += [uuid for uuid in fingerprints if uuid.hex[-8:].upper() in stale
+                        and uuid in self.__fingerprints and uuid not in changed]
+
+        results, errors = self.__parse_uuids(added + changed, workers, executor, on_progress)
+
+        for uuid in removed + changed:
+            previous.pop(uuid, None)
+            self.parse_errors.pop(uuid, None)
+        previous.update(results)
+        self.parse_errors.update(errors)
+
+        self.__fingerprints = fingerprints
+        self.stories = [previous[uuid] for uuid in self.story_list if uuid in previous]
+        return {'added': added, 'changed': changed, 'removed': removed}
+
+    def __revalidate_asset_index(self):
+        # returns the ids of the story folders whose shared assets changed
+        stale = self.asset_index.revalidate()
+        if self.asset_cache is not None:
+            for path, key in stale.items():
+                # either may hold the bytes of the changed file
+                self.asset_cache.discard(path)
+                self.asset_cache.discard(key)
+
+        content_path = f"{self.mountpoint}/.content/"
+        return {path[len(content_path):].split('/', 1)[0] for path in stale if path.startswith(content_path)}
+
+    def watch(self, on_change=None, interval=2.0, stop_event=None, inotify=True, **refresh_args):
+        """
+        Keeps the device up to date, calling refresh() whenever something changes, until stop_event is set.
+        Changes are waited for with inotify where available (Linux), and polled every
+        `interval` seconds otherwise. on_change(changes) is called after each refresh that found changes.
+        """
+        stop_event = stop_event or threading.Event()
+        watcher = InotifyWatcher() if inotify and InotifyWatcher.available() else None
+
+        try:
+            while not stop_event.is_set():
+                if watcher is not None:
+                    content_path = f"{self.mountpoint}/.content"
+                    for path in [self.mountpoint, content_path] + [
+                            f"{content_path}/{uuid.hex[-8:].upper()}" for uuid in self.story_list]:
+                        watcher.add(path)
+                    if self.asset_index is not None:
+                        # shared assets can be rewritten in place, in folders of their own
+                        for path in self.asset_index.folders():
+                            watcher.add(path)
+                    if not watcher.wait(interval):
+                        continue
+                    # a sync writes several files in a row, they are handled at once
+                    for _ in range(10):
+                        if not watcher.wait(0.1):
+                            break
+                elif stop_event.wait(interval):
+                    break
+
+                changes = self.refresh(**refresh_args)
+                if on_change is not None and any(changes.values()):
+                    on_change(changes)
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+    def index_assets(self, workers=4):
+        """
+        Indexes the rf/ and sf/ files of every story by content (size, then hash),
+        so identical assets of different stories are read, deciphered and cached once.
+        Parsed stories are updated, stories parsed afterwards use it too.
+        The index report() gives the bytes lost in duplicates.
+        """
+        story_paths = [f"{self.mountpoint}/.content/{uuid.hex[-8:].upper()}" for uuid in self.story_list]
+        self.asset_index = AssetIndex.build(story_paths, workers)
+        for story in self.stories:
+            story.attach_asset_cache(self.asset_cache, self.asset_index)
+        return self.asset_index
+
+    def warm_asset_cache(self, stories=None, batch_size=256, backend="xxtea"):
+        """
+        Loads the assets of the given stories (every parsed story by default) in the asset cache,
+        until it is full. Image headers are deciphered in batches with decrypt_blocks().
+        Returns the number of assets loaded.
+        """
+        if self.asset_cache is None:
+            return 0
+
+        images, audios = [], []
+        for story in stories if stories is not None else self.stories:
+            paths = story.asset_paths()
+            images.extend(paths['image'])
+            audios.extend(paths['audio'])
+
+        # one path per distinct asset, copies share its cache entry
+        key = self.asset_index.key if self.asset_index is not None else (lambda path: path)
+        images = list({key(path): path for path in images}.values())
+        audios = list({key(path): path for path in audios}.values())
+
+        loaded = 0
+        for start in range(0, len(images), batch_size):
+            headers, tails, paths = [], [], []
+            for path in images[start:start + batch_size]:
+                if key(path) in self.asset_cache:
+                    continue
+                try:
+                    with open(path, 'rb') as fp:
+                        header, tail = fp.read(0x200), fp.read()
+                except OSError:
+                    continue
+                if header:
+                    headers.append(header)
+                    tails.append(tail)
+                    paths.append(path)
+
+            for path, header, tail in zip(paths, decrypt_blocks(headers, self.lunii_generic_key, backend), tails):
+                if self.asset_cache.size + len(header) + len(tail) > self.asset_cache.max_bytes:
+                    return loaded
+                self.asset_cache.put(key(path), header + tail)
+                loaded += 1
+
+        for path in audios:
+            if key(path) in self.asset_cache:
+                continue
+            try:
+                with open(path, 'rb') as fp:
+                    content = fp.read()
+            except OSError:
+                continue
+            if self.asset_cache.size + len(content) > self.asset_cache.max_bytes:
+                return loaded
+            self.asset_cache.put(key(path), content)
+            loaded += 1
+
+        return loaded
+
+    def export(self, path, format="zip", workers=4, on_progress=None):
+        """
+        Exports every story of the device (see Story.export) in one zip archive or folder,
+        each story under its UUID, next to a device.json listing them.
+        `workers` only applies to folders, zip archives are written sequentially.
+        Stories not parsed yet are parsed one at a time and dropped once written,
+        so memory stays bounded whatever the number of packs.
+        on_progress(done, total, uuid, error) is called after each story.
+        Returns the errors of the stories that couldn't be exported, keyed by UUID.
+        """
+        parsed = {story.full_uuid: story for story in self.stories}
+        total = len(self.story_list)
+        errors, exported = {}, []
+
+        with open_writer(path, format) as writer:
+            for done, uuid in enumerate(self.story_list, 1):
+                error = None
+                try:
+                    story = parsed.get(uuid) or self.parse_story(uuid)
+                    story._export_to(writer, f"{uuid}/", workers)
+                    exported.append({'uuid': str(uuid), 'title': story.title, 'path': f"{uuid}/"})
+                except Exception as e:
+                    errors[uuid] = error = e
+                if on_progress is not None:
+                    on_progress(done, total, uuid, error)
+
+            writer.add_bytes('device.json', dump_json({
+                'snu': self.snu,
+                'firmware': f"{self.fw_vers_major}.{self.fw_vers_minor}",
+                'stories': exported,
+            }))
+
+        return errors
+
+    def verify_all(self, workers=4, on_progress=None):
+        """
+        Checks every story of .pi concurrently, without parsing their nodes: required files
+        and assets, indexes consistent with their ni header, and authorization for this device.
+        Results are dicts keyed by UUID, in .pi order, with a 'status' among
+        authorized, unauthorized, corrupt and missing, and the details ('missing', 'problems').
+        A result is reused until the story files, its rf/ and sf/ folders (or the device key) change.
+        on_progress(done, total, uuid, result) is called after each story.
+        """
+        total = len(self.story_list)
+        paths = {uuid: f"{self.mountpoint}/.content/{uuid.hex[-8:].upper()}" for uuid in self.story_list}
+
+        def check(uuid):
+            fingerprint = verification_fingerprint(paths[uuid], self.device_key)
+            cached = self.__verifications.get(uuid)
+            if cached is not None and cached[0] == fingerprint:
+                return cached[1]
+            result = verify_story(paths[uuid], self.device_key, self.lunii_generic_key)
+            self.__verifications[uuid] = (fingerprint, result)
+            return result
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(check, uuid): uuid for uuid in dict.fromkeys(self.story_list)}
+            for done, future in enumerate(as_completed(futures), 1):
+                uuid = futures[future]
+                results[uuid] = future.result()
+                if on_progress is not None:
+                    on_progress(done, total, uuid, results[uuid])
+
+        return {uuid: results[uuid] for uuid in self.story_list}
+
+    def list_stories(self):
+        """
+        Stories of the device read with depth="header": version, counts, night mode,
+        authorization and title, without parsing their nodes (see Story.load()).
+        Stories that can't be read are left out, their errors are kept in `self.list_errors`.
+        """
+        keys = (self.device_key, self.lunii_generic_key)
+        stories, self.list_errors = [], {}
+        for uuid in self.story_list:
+            try:
+                stories.append(Story(self.mountpoint, uuid, keys, self.asset_cache, self.story_cache,
+                                     self.asset_index, depth="header"))
+            except Exception as e:
+                self.list_errors[uuid] = e
+        return stories
 
     def parse_story(self, uuid):
         if uuid in self.story_list:
-            return Story(self.mountpoint, uuid, (self.device_key, self.lunii_generic_key))
+            return Story(self.mountpoint, uuid, (self.device_key, self.lunii_generic_key),
+                         self.asset_cache, self.story_cache, self.asset_index)
         return None
         
     def __get_hw_info(self):
@@ -41,6 +320,8 @@ class Device:
             
             fp_md.seek(0x100)
             self.raw_devkey = fp_md.read(0x100)
+            instrument.count('file_opens')
+            instrument.count('bytes_read', 12 + len(self.raw_devkey))
 
             # I'll rewrite that with utils.py:ByteBuffer
             dec = Decryption(self.lunii_generic_key, bytes=self.raw_devkey).result.bytes
@@ -65,9 +346,66 @@ class Device:
                     self.story_list.append(UUID(bytes=next_uuid))
                 else:
                     loop_again = False
+        instrument.count('file_opens')
+        instrument.count('bytes_read', 16 * len(self.story_list))
+
+    def __story_fingerprint(self, uuid):
+        story_path = f"{self.mountpoint}/.content/{uuid.hex[-8:].upper()}"
+        return (file_fingerprint(story_path), story_fingerprint(story_path, self.device_key))
+
+    def __parse_stories(self, workers, executor, on_progress):
+        self.__fingerprints = {uuid: self.__story_fingerprint(uuid) for uuid in self.story_list}
+        results, self.parse_errors = self.__parse_uuids(self.story_list, workers, executor, on_progress)
+        self.stories = [results[uuid] for uuid in self.story_list if uuid in results]
+
+    def __parse_uuids(self, uuids, workers, executor, on_progress):
+        # returns the parsed stories and the parse errors, both keyed by UUID
+        keys = (self.device_key, self.lunii_generic_key)
+        total = len(uuids)
+        results, errors = {}, {}
+
+        def collect(uuid, story, error, done):
+            if error is None:
+                results[uuid] = story
+            else:
+                errors[uuid] = error
+            if on_progress is not None:
+                on_progress(done, total, uuid, error)
+
+        if workers <= 1:
+            for done, uuid in enumerate(uuids, 1):
+                try:
+                    story, error = _parse_story(self.mountpoint, uuid, keys, self.asset_cache, self.story_cache,
+                                                self.asset_index), None
+                except Exception as e:
+                    story, error = None, e
+                collect(uuid, story, error, done)
+        else:
+            if executor == "thread":
+                pool, shared_cache = ThreadPoolExecutor(max_workers=workers), self.asset_cache
+                shared_index = self.asset_index
+            elif executor == "process":
+                # the asset cache can't cross process boundaries, it is attached afterwards
+                pool, shared_cache = ProcessPoolExecutor(max_workers=workers), None
+                # and the index is not worth pickling for every story
+                shared_index = None
+            else:
+                raise ValueError(f"Unknown executor: {executor}")
+
+            with pool:
+                futures = {
+                    pool.submit(_parse_story, self.mountpoint, uuid, keys, shared_cache, self.story_cache,
+                                shared_index): uuid
+                    for uuid in uuids
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    uuid = futures[future]
+                    error = future.exception()
+                    story = future.result() if error is None else None
+                    if story is not None and shared_cache is None:
+                        story.attach_asset_cache(self.asset_cache, self.asset_index)
+                    collect(uuid, story, error, done)
 
-    def __parse_stories(self):
-        self.stories = []
-        for story in self.story_list:
-            self.stories.append(Story(self.mountpoint, story, (self.device_key, self.lunii_generic_key)))
-      
\ No newline at end of file
+        if self.story_cache is not None:
+            self.story_cache.prune()
+        return results, errors
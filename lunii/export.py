@@ -0,0 +1,196 @@
+import io
+import os
+import json
+import shutil
+import zipfile
+import posixpath
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .utils import decrypt_files
+
+EXPORT_FORMATS = ('zip', 'dir')
+
+# copy buffer size, the most an asset costs in memory while being written
+CHUNK_SIZE = 1024 * 1024
+
+def safe_name(name: str) -> str:
+    """
+    Normalized relative name of an exported file.
+    Names come from the story indexes, so any that would land outside
+    of the export root (absolute, or going up with '..') are rejected.
+    """
+    normalized = posixpath.normpath(name.replace('\\', '/'))
+    if normalized.startswith('/') or normalized in ('.', '..') or normalized.startswith('../') \
+            or os.path.isabs(normalized) or os.path.splitdrive(normalized)[0]:
+        raise ValueError(f"Exported file name escapes the export root: {name!r}")
+    return normalized
+
+class DirWriter:
+    """
+    Writes exported files in a folder. Files are independent, so they can be written concurrently.
+    """
+    concurrent = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.root = os.path.realpath(path)
+        os.makedirs(path, exist_ok=True)
+
+    def __target(self, name: str) -> str:
+        target = os.path.join(self.root, *safe_name(name).split('/'))
+        # symlinks already in the output folder can't redirect writes either
+        if os.path.commonpath([self.root, os.path.realpath(target)]) != self.root:
+            raise ValueError(f"Exported file name escapes the export root: {name!r}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return target
+
+    def add(self, name: str, fp):
+        with open(self.__target(name), 'wb') as out:
+            shutil.copyfileobj(fp, out, CHUNK_SIZE)
+
+    def add_bytes(self, name: str, data: bytes):
+        with open(self.__target(name), 'wb') as out:
+            out.write(data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ZipWriter:
+    """
+    Writes exported files in a zip archive, each one streamed in its entry.
+    Assets are already compressed (MP3, RLE4 BMP), so they are stored as is.
+    """
+    concurrent = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self.zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    def add(self, name: str, fp):
+        with self.zip.open(safe_name(name), 'w', force_zip64=True) as out:
+            shutil.copyfileobj(fp, out, CHUNK_SIZE)
+
+    def add_bytes(self, name: str, data: bytes):
+        self.zip.writestr(safe_name(name), data, compress_type=zipfile.ZIP_DEFLATED)
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_writer(path: str, format: str = "zip") -> DirWriter | ZipWriter:
+    if format == "zip":
+        return ZipWriter(path)
+    if format == "dir":
+        return DirWriter(path)
+    raise ValueError(f"Unknown export format: {format} (expected one of {', '.join(EXPORT_FORMATS)})")
+
+def open_assets(files: list, backend: str = "xxtea") -> list:
+    """
+    Plaintext of (path, key) asset files as file-like objects, in the same order.
+    Images are deciphered (first block only, the rest is mapped from the file)
+    with one decrypt_blocks() call per key, sounds (key None) are opened as is.
+    """
+    opened = [None] * len(files)
+    groups = {}
+    for position, (path, key) in enumerate(files):
+        groups.setdefault(key, []).append(position)
+
+    try:
+        for key, positions in groups.items():
+            if key is None:
+                for position in positions:
+                    opened[position] = open(files[position][0], 'rb')
+                continue
+            streams = decrypt_files([files[position][0] for position in positions], key, backend)
+            for position, stream in zip(positions, streams):
+                opened[position] = stream if stream is not None else io.BytesIO()
+    except Exception:
+        for fp in opened:
+            if fp is not None:
+                fp.close()
+        raise
+    return opened
+
+def export_files(writer: DirWriter | ZipWriter, files, workers: int = 4, window: int = 64,
+                 backend: str = "xxtea"):
+    """
+    Writes (name, path, key) files through the writer, `window` files at a time:
+    the images of a window are deciphered in one batch in the calling thread, then the files
+    are written, by `workers` threads if the writer allows it (folders do, zip archives
+    are written sequentially and ignore `workers`).
+    At most `window` files are open at once, so memory stays bounded
+    whatever the number of files.
+    """
+    files = iter(files)
+    with ThreadPoolExecutor(max_workers=max(1, workers if writer.concurrent else 1)) as pool:
+        while True:
+            batch = list(islice(files, window))
+            if not batch:
+                break
+
+            opened = open_assets([(path, key) for _, path, key in batch], backend)
+            try:
+                names = [name for name, _, _ in batch]
+                if writer.concurrent:
+                    futures = [pool.submit(writer.add, name, fp) for name, fp in zip(names, opened)]
+                    # every write is over before the files are closed, then the first error is raised
+                    wait(futures)
+                    for future in futures:
+                        future.result()
+                else:
+                    for name, fp in zip(names, opened):
+                        writer.add(name, fp)
+            finally:
+                for fp in opened:
+                    fp.close()
+
+def describe_story(story, images: list, audio: list) -> dict:
+    """
+    JSON description of a story and its node graph.
+    images and audio are the exported names of the story indexes entries.
+    """
+    table = story.node_table
+    nodes = []
+    for index in range(len(table)):
+        node = story.stage_nodes[index]
+        controls = node.control_settings
+        ri_index, si_index = table.ri_index[index], table.si_index[index]
+        nodes.append({
+            'index': index,
+            'image': images[ri_index] if 0 <= ri_index < len(images) else None,
+            'audio': audio[si_index] if 0 <= si_index < len(audio) else None,
+            'next': [transition.to_index for transition in node.next_transitions],
+            'home': [transition.to_index for transition in node.home_transitions],
+            'controls': {
+                'wheel': controls.wheel,
+                'ok': controls.ok,
+                'home': controls.home,
+                'pause': controls.pause,
+                'autoplay': controls.autoplay,
+            },
+        })
+
+    return {
+        'uuid': str(story.full_uuid),
+        'title': story.title,
+        'version': story.version,
+        'night_mode': story.night_mode,
+        'authorized': story.authorized,
+        'factory_disabled': bool(table.factory_disabled),
+        'nodes': nodes,
+    }
+
+def dump_json(data) -> bytes:
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
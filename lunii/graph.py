@@ -0,0 +1,177 @@
+from array import array
+from collections import deque
+from typing import List
+
+from .utils import NodeTable
+
+class StoryGraph:
+    """
+    Transitions of a story as CSR adjacency arrays, built from its node table.
+
+    The successors of node i are indices[indptr[i]:indptr[i + 1]]: its next
+    transitions first (next_degree[i] of them), then its home transitions.
+    Transitions pointing outside of the story are not part of the graph,
+    they are listed in `invalid_transitions` as (node, start, count) ranges
+    (start is None when the list node index itself is invalid).
+
+    Every analysis runs in O(nodes + transitions).
+    """
+    def __init__(self, table: NodeTable, nodes_index_list: List[int]):
+        self.count = count = len(table)
+        self.indptr = array('i', [0])
+        self.indices = array('i')
+        self.next_degree = array('i')
+        self.invalid_transitions = []
+
+        for i in range(count):
+            self.__add_transitions(i, table.next_index[i], table.next_count[i], table.next_selected[i], nodes_index_list)
+            self.next_degree.append(len(self.indices) - self.indptr[i])
+            self.__add_transitions(i, table.home_index[i], table.home_count[i], table.home_selected[i], nodes_index_list)
+            self.indptr.append(len(self.indices))
+
+        self.__depth = None
+        self.__parent = None
+
+    def __add_transitions(self, node, node_index, nodes_count, selected, nodes_index_list):
+        # same conditions as StageNodes transitions
+        if node_index == -1 or nodes_count == -1 or selected == -1:
+            return
+        if not 0 <= node_index < len(nodes_index_list) or nodes_count < 0:
+            self.invalid_transitions.append((node, None, nodes_count))
+            return
+        start = nodes_index_list[node_index]
+        end = start + nodes_count
+
+        # clamped to the table, a corrupt count costs no more than a valid one
+        low, high = max(start, 0), min(end, self.count)
+        if low < high:
+            self.indices.extend(range(low, high))
+        else:
+            low = high = min(max(start, 0), self.count)
+        if start < low:
+            self.invalid_transitions.append((node, start, min(low, end) - start))
+        if high < end:
+            self.invalid_transitions.append((node, max(high, start), end - max(high, start)))
+
+    def successors(self, node: int) -> array:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def __bfs(self):
+        # breadth first walk from the cover node, giving depths and shortest paths at once
+        depth = array('i', [-1]) * self.count
+        parent = array('i', [-1]) * self.count
+        if self.count:
+            depth[0] = 0
+            queue = deque([0])
+            indptr, indices = self.indptr, self.indices
+            while queue:
+                node = queue.popleft()
+                for target in indices[indptr[node]:indptr[node + 1]]:
+                    if depth[target] == -1:
+                        depth[target] = depth[node] + 1
+                        parent[target] = node
+                        queue.append(target)
+        self.__depth, self.__parent = depth, parent
+
+    @property
+    def depth(self) -> array:
+        """
+        Per node distance from node #0, in transitions, -1 if unreachable
+        """
+        if self.__depth is None:
+            self.__bfs()
+        return self.__depth
+
+    def reachable(self) -> List[int]:
+        return [node for node, depth in enumerate(self.depth) if depth != -1]
+
+    def unreachable(self) -> List[int]:
+        return [node for node, depth in enumerate(self.depth) if depth == -1]
+
+    def dead_ends(self) -> List[int]:
+        """
+        Nodes without any next transition (the player stops or autoplays there)
+        """
+        return [node for node, degree in enumerate(self.next_degree) if degree == 0]
+
+    def shortest_path(self, target: int) -> List[int] | None:
+        """
+        Nodes on a shortest path from node #0 to target (both included), None if unreachable
+        """
+        if self.depth[target] == -1:
+            return None
+        path = [target]
+        while path[-1] != 0:
+            path.append(self.__parent[path[-1]])
+        path.reverse()
+        return path
+
+    def cycles(self) -> List[List[int]]:
+        """
+        Strongly connected components containing a cycle (Tarjan's algorithm, iterative)
+        """
+        count, indptr, indices = self.count, self.indptr, self.indices
+        index = array('i', [-1]) * count
+        lowlink = array('i', [0]) * count
+        on_stack = bytearray(count)
+        stack, components = [], []
+        counter = 0
+
+        for root in range(count):
+            if index[root] != -1:
+                continue
+            # (node, position of the next successor to visit)
+            work = [(root, indptr[root])]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+
+            while work:
+                node, position = work[-1]
+                if position < indptr[node + 1]:
+                    work[-1] = (node, position + 1)
+                    target = indices[position]
+                    if index[target] == -1:
+                        index[target] = lowlink[target] = counter
+                        counter += 1
+                        stack.append(target)
+                        on_stack[target] = 1
+                        work.append((target, indptr[target]))
+                    elif on_stack[target]:
+                        lowlink[node] = min(lowlink[node], index[target])
+                    continue
+
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    lowlink[caller] = min(lowlink[caller], lowlink[node])
+
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in self.successors(node):
+                        components.append(sorted(component))
+
+        return components
+
+    def report(self) -> dict:
+        """
+        Summary of the analyses, for validating a pack
+        """
+        depth = self.depth
+        return {
+            'nodes': self.count,
+            'transitions': len(self.indices),
+            'reachable': sum(1 for d in depth if d != -1),
+            'unreachable': self.unreachable(),
+            'dead_ends': self.dead_ends(),
+            'cycles': len(self.cycles()),
+            'max_depth': max(depth, default=-1),
+            'invalid_transitions': self.invalid_transitions,
+        }
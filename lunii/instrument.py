@@ -0,0 +1,145 @@
+# Opt-in instrumentation of parsing and playback
+#
+# Timing spans per phase (device info, every step of Story.populate, player steps),
+# counters (bytes read, bytes decrypted, file opens) and events (player transitions).
+#
+#   with instrument() as recorder:
+#       device = Device('/media/lunii')
+#       device.parse_stories()
+#   recorder.dump('trace.json')
+#
+# When no recorder is installed, span() returns a shared no-op context manager
+# and count() is a single global lookup, so the hooks cost next to nothing.
+
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+_NULL_SPAN = nullcontext()
+
+# installed Recorder, None when disabled
+_recorder = None
+
+class Span:
+    __slots__ = ('recorder', 'name', 'attrs', 'start')
+
+    def __init__(self, recorder, name, attrs):
+        self.recorder = recorder
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.recorder.record({
+            'type': 'span',
+            'name': self.name,
+            'start_ms': (self.start - self.recorder.origin) * 1000,
+            'duration_ms': (end - self.start) * 1000,
+            'thread': threading.current_thread().name,
+            **self.attrs,
+        })
+
+class Recorder:
+    """
+    Collects spans, events and counters. callback(record), if given,
+    is called with every span and event as they are recorded.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.origin = time.perf_counter()
+        self.records = []
+        self.counters = {}
+        self.__lock = threading.Lock()
+
+    def record(self, record: dict):
+        with self.__lock:
+            self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def count(self, name: str, value: int = 1):
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> dict:
+        """
+        Spans aggregated by name: count, total and max duration
+        """
+        spans = {}
+        for record in self.records:
+            if record['type'] != 'span':
+                continue
+            stats = spans.setdefault(record['name'], {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += record['duration_ms']
+            stats['max_ms'] = max(stats['max_ms'], record['duration_ms'])
+        return spans
+
+    def to_dict(self) -> dict:
+        return {
+            'counters': dict(self.counters),
+            'summary': self.summary(),
+            'records': list(self.records),
+        }
+
+    def dump(self, file):
+        """
+        Writes to_dict() as JSON, to a path or a text file object
+        """
+        if isinstance(file, str):
+            with open(file, 'w') as fp:
+                json.dump(self.to_dict(), fp, indent=2, default=str)
+        else:
+            json.dump(self.to_dict(), file, indent=2, default=str)
+
+def enable(callback=None) -> Recorder:
+    global _recorder
+    _recorder = Recorder(callback)
+    return _recorder
+
+def disable():
+    global _recorder
+    _recorder = None
+
+@contextmanager
+def instrument(callback=None):
+    """
+    Records everything happening in the block, from every thread
+    """
+    global _recorder
+    previous = _recorder
+    recorder = enable(callback)
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+
+def span(name: str, **attrs):
+    recorder = _recorder
+    if recorder is None:
+        return _NULL_SPAN
+    return Span(recorder, name, attrs)
+
+def count(name: str, value: int = 1):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, value)
+
+def event(name: str, **attrs):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.record({
+            'type': 'event',
+            'name': name,
+            'start_ms': (time.perf_counter() - recorder.origin) * 1000,
+            'thread': threading.current_thread().name,
+            **attrs,
+        })
+
+def enabled() -> bool:
+    return _recorder is not None
@@ -1,27 +1,26 @@
-import requests
-import time
-import json
+# Refreshes the titles index from packs.json
+#
+# Usage: python -m lunii.parse_titles [output] [--url URL]
+#
+# Same refresh as StoryMetadata(refresh=True): conditional request, streamed parsing,
+# every locale kept. The default output is the user data titles.json.
 
-url = "https://raw.githubusercontent.com/o-daneel/Lunii.RE/main/resources/packs.json"
-response = requests.get(url).json()
+import sys
+import argparse
 
-results = []
-
-for key in response["response"]:
-    entry = response["response"][key]
-    localized_infos = entry.get("localized_infos", {}).get("fr_FR", {})
-    if not localized_infos:
-        continue
-    else:
-        title = localized_infos.get("title", "")
-    result = {
-        "uuid": entry.get("uuid", ""),
-        "title": title,
-        "keywords": entry.get("keywords", ""),
-        "subtitle": entry.get("subtitle", ""),
-    }
-    results.append(result)
+from .utils import StoryMetadata, PACKS_URL
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refreshes the titles index from packs.json")
+    parser.add_argument('output', nargs='?', help="titles file, the user data titles.json by default")
+    parser.add_argument('--url', default=PACKS_URL)
+    args = parser.parse_args(argv)
 
+    metadata = StoryMetadata(args.output)
+    if metadata.refresh(args.url):
+        print(f"{metadata.filename}: {len(metadata.load_titles())} titles")
+    else:
+        print(f"{metadata.filename}: up to date")
 
-json.dump(results, open("titles.json", "w"), indent=4)
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
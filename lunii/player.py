@@ -1,26 +1,110 @@
 import time
+import asyncio
+import inspect
 from typing import List
-
-from .utils import Buttons
-
-class StoryPlayer:
-    def __init__(self, story, interactive=True, display_cb=None, audio_cb=None):
+from concurrent.futures import ThreadPoolExecutor
+
+from . import instrument
+from .instrument import span
+from .utils import Buttons, AssetCache, AudioEngine
+
+class AssetPrefetcher:
+    """
+    Loads the assets of upcoming nodes in a small thread pool, while the current one plays.
+    At most `window` nodes are queued at once, and nodes leaving the window
+    (the user moved elsewhere) are cancelled if not started yet.
+    Only images are prefetched by default: VLC reads sounds from their path,
+    so their bytes are only worth loading when an audio callback consumes them.
+    """
+    def __init__(self, story, workers=2, window=8, audio=False):
+        self.story = story
+        self.window = window
+        self.audio = audio
+        self.__pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lunii-prefetch')
+        self.__pending = {}
+
+    def __load(self, index):
+        with span('player.prefetch', node=index):
+            self.__load_assets(index)
+
+    def __load_assets(self, index):
+        assets = self.story.stage_nodes[index].assets
+        for kind in ('image', 'audio') if self.audio else ('image',):
+            asset = assets.get(kind)
+            if asset is not None:
+                # materializes the content, kept by the asset or the device cache
+                asset.content
+
+    def prefetch(self, indexes):
+        """
+        Prefetches the given nodes, by order of priority
+        """
+        count = len(self.story.stage_nodes)
+        wanted = [index for index in dict.fromkeys(indexes) if 0 <= index < count][:self.window]
+
+        for index, future in list(self.__pending.items()):
+            if future.done() or index not in wanted:
+                future.cancel()
+                del self.__pending[index]
+
+        for index in wanted:
+            if index not in self.__pending:
+                self.__pending[index] = self.__pool.submit(self.__load, index)
+
+    def cancel(self):
+        self.prefetch([])
+
+    def close(self):
+        self.__pool.shutdown(wait=False, cancel_futures=True)
+        self.__pending = {}
+
+class BasePlayer:
+    """
+    Playback state and navigation, shared by StoryPlayer and AsyncStoryPlayer
+    """
+    def __init__(self, story, display_cb=None, audio_cb=None, prefetch=True, prefetch_window=8):
         self.story = story
         self.current_node_idx = 0
         self.audio_supressed = False
         self.playing = True
         self.node_history = [0]
 
-        self.interactive = interactive
         self.display_cb = display_cb
         self.audio_cb = audio_cb
-        self.pending_input = None
-    
+
+        # rendered terminal frames, shared by every image displayed during the session
+        self.frame_cache = AssetCache(4 * 1024 * 1024)
+
+        # assets of the nodes reachable from the current one are loaded in the background
+        self.prefetcher = None
+        if prefetch:
+            self.prefetcher = AssetPrefetcher(story, window=prefetch_window, audio=audio_cb is not None)
+
+    def _prefetch(self, node, cursor=None):
+        if self.prefetcher is None:
+            return
+        targets = [transition.to_index for transition in node.next_transitions]
+        if cursor is not None:
+            # options closest to the wheel position come first
+            targets.sort(key=lambda index: abs(index - cursor))
+        targets += [transition.to_index for transition in node.home_transitions]
+        self.prefetcher.prefetch(targets)
+
+    def close(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+
+    def _transition(self, node_index):
+        instrument.count('player.transitions')
+        instrument.event('player.transition', story=self.story.uuid, src=self.current_node_idx, dst=node_index)
+
     def walk_to_node(self, node_index):
+        self._transition(node_index)
         self.current_node_idx = node_index
         self.node_history.append(self.current_node_idx)
 
     def reset_to_node(self, node_index):
+        self._transition(node_index)
         self.current_node_idx = node_index
         self.node_history = [node_index]
 
@@ -32,16 +116,32 @@ class StoryPlayer:
             self.node_history.pop()
             self.current_node_idx = self.node_history[-1]
 
+class StoryPlayer(BasePlayer):
+    def __init__(self, story, interactive=True, display_cb=None, audio_cb=None, prefetch=True, prefetch_window=8):
+        super().__init__(story, display_cb, audio_cb, prefetch, prefetch_window)
+
+        self.interactive = interactive
+        self.pending_input = None
+
     def display_bitmap(self, bitmap):
+        with span('player.display', path=bitmap.path):
+            self.__display_bitmap(bitmap)
+
+    def __display_bitmap(self, bitmap):
         if self.interactive:
             print("\033[H\033[J")
-            bitmap.show()
+            bitmap.show(frame_cache=self.frame_cache)
         elif self.display_cb is not None:
             self.display_cb(bitmap.content)
         else:
             print("No display callback defined! Skipping Image...")
 
     def play_audio(self, audio):
+        # lasts as long as the clip, playback is waited for
+        with span('player.audio', path=audio.path):
+            self.__play_audio(audio)
+
+    def __play_audio(self, audio):
         if not self.interactive:
             if self.audio_cb is not None:
                 self.audio_cb(audio.content, audio.path)
@@ -49,9 +149,7 @@ class StoryPlayer:
                 print("No audio callback defined! Defaulting to vlc...")
 
         audio.play()
-        while audio.is_playing:
-            time.sleep(0.1)
-        audio.release()
+        audio.wait()
 
         
     def play(self):
@@ -61,6 +159,7 @@ class StoryPlayer:
 
         while self.playing:
             current_node = self.story.stage_nodes[self.current_node_idx]
+            self._prefetch(current_node)
 
             if current_node.assets['image'] is not None:
                 self.display_bitmap(current_node.assets['image'])
@@ -108,6 +207,7 @@ class StoryPlayer:
                     seek_node = self.story.stage_nodes[seek_index]
 
                     if to_replay_assets:
+                        self._prefetch(current_node, seek_index)
                         if seek_node.assets['image'] is not None:
                             self.display_bitmap(seek_node.assets['image'])
 
@@ -160,6 +260,8 @@ class StoryPlayer:
                             self.walk_to_node(home_transition.to_index)
                             break
 
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
         print("Story ended.")
 
     def feed_input(self, button):
@@ -188,3 +290,170 @@ class StoryPlayer:
                 time.sleep(0.2)
             print("Invalid input")
             return self._simulate_input(wheel, ok, home)
+
+
+class AsyncStoryPlayer(BasePlayer):
+    """
+    asyncio flavour of StoryPlayer.
+    Button presses are awaited from a queue, and the end of audio playback is awaited
+    instead of polled, so a single event loop can drive many players. run() can be cancelled.
+
+    display_cb(content) and audio_cb(content, path) may be coroutine functions.
+    When audio_cb is given, it replaces VLC playback: the clip is over once it returns.
+    Otherwise clips play on audio_engine, or on a media player of the player's own
+    (on the process-wide libVLC instance), so that players sharing an event loop
+    don't interrupt each other.
+    """
+    def __init__(self, story, display_cb=None, audio_cb=None, prefetch=True, prefetch_window=8,
+                 audio_engine=None):
+        super().__init__(story, display_cb, audio_cb, prefetch, prefetch_window)
+        self.input_queue = asyncio.Queue()
+        self.audio_engine = audio_engine
+        self.__owns_engine = audio_engine is None
+
+    def close(self):
+        super().close()
+        if self.__owns_engine and self.audio_engine is not None:
+            self.audio_engine.release()
+            self.audio_engine = None
+
+    def feed_input(self, button):
+        # must be called from the event loop thread, use loop.call_soon_threadsafe otherwise
+        buttons = [Buttons.PLUS, Buttons.OK, Buttons.HOME, Buttons.MINUS]
+        if button not in buttons:
+            return False
+        self.input_queue.put_nowait(button)
+        return True
+
+    async def __call_cb(self, cb, *args):
+        result = cb(*args)
+        if inspect.isawaitable(result):
+            await result
+
+    async def display_bitmap(self, bitmap):
+        with span('player.display', path=bitmap.path):
+            await self.__display_bitmap(bitmap)
+
+    async def __display_bitmap(self, bitmap):
+        if self.display_cb is None:
+            return
+        # reading and deciphering the image happens off the event loop
+        content = await asyncio.to_thread(getattr, bitmap, 'content')
+        await self.__call_cb(self.display_cb, content)
+
+    async def play_audio(self, audio):
+        with span('player.audio', path=audio.path):
+            await self.__play_audio(audio)
+
+    async def __play_audio(self, audio):
+        if self.audio_cb is not None:
+            content = await asyncio.to_thread(getattr, audio, 'content')
+            await self.__call_cb(self.audio_cb, content, audio.path)
+            return
+
+        if self.audio_engine is None:
+            self.audio_engine = AudioEngine(instance=AudioEngine.shared_instance())
+
+        loop = asyncio.get_running_loop()
+        ended = loop.create_future()
+
+        def on_end():
+            # called from a VLC thread
+            loop.call_soon_threadsafe(lambda: ended.done() or ended.set_result(None))
+
+        self.audio_engine.play(audio.path, on_end)
+        try:
+            await ended
+        except asyncio.CancelledError:
+            self.audio_engine.stop()
+            raise
+
+    async def _next_input(self, wheel, ok, home):
+        while True:
+            user_input = await self.input_queue.get()
+            if wheel and user_input in (Buttons.PLUS, Buttons.MINUS):
+                return user_input
+            elif ok and user_input == Buttons.OK:
+                return Buttons.OK
+            elif home and user_input == Buttons.HOME:
+                return Buttons.HOME
+            # invalid inputs are dropped, waiting for the next one
+
+    async def run(self):
+        self.playing = True
+        try:
+            while self.playing:
+                current_node = self.story.stage_nodes[self.current_node_idx]
+                self._prefetch(current_node)
+
+                if current_node.assets['image'] is not None:
+                    await self.display_bitmap(current_node.assets['image'])
+
+                if current_node.assets['audio'] is not None:
+                    if not self.audio_supressed:
+                        await self.play_audio(current_node.assets['audio'])
+                    self.audio_supressed = False
+                else:
+                    break
+
+                next_transitions = current_node.next_transitions
+
+                if len(next_transitions) == 0:
+                    # out of transitions, advancing to the next node like StoryPlayer does
+                    if self.current_node_idx + 1 >= len(self.story.stage_nodes):
+                        break
+                    self.walk_to_node(self.current_node_idx + 1)
+
+                elif len(next_transitions) == 1:
+                    self.walk_to_node(next_transitions[0].to_index)
+
+                else:
+                    await self.__choose(current_node, next_transitions)
+        finally:
+            self.playing = False
+            if self.prefetcher is not None:
+                self.prefetcher.cancel()
+
+    async def __choose(self, current_node, next_transitions):
+        seek_index = next_transitions[0].to_index
+        min_seek_index = seek_index
+        max_seek_index = seek_index + (len(next_transitions) - 1)
+
+        controls = self.story.stage_nodes[seek_index].control_settings
+        to_replay_assets = True
+
+        while True:
+            seek_node = self.story.stage_nodes[seek_index]
+
+            if to_replay_assets:
+                self._prefetch(current_node, seek_index)
+                if seek_node.assets['image'] is not None:
+                    await self.display_bitmap(seek_node.assets['image'])
+                if seek_node.assets['audio'] is not None:
+                    await self.play_audio(seek_node.assets['audio'])
+                to_replay_assets = False
+
+            input_button = await self._next_input(controls.wheel, controls.ok, controls.home)
+
+            if input_button == Buttons.PLUS:
+                seek_index = min(seek_index + 1, max_seek_index)
+                to_replay_assets = True
+
+            elif input_button == Buttons.MINUS:
+                seek_index = max(seek_index - 1, min_seek_index)
+                to_replay_assets = True
+
+            elif input_button == Buttons.OK:
+                self.walk_to_node(seek_index)
+                self.audio_supressed = True
+                return
+
+            elif input_button == Buttons.HOME:
+                home_transitions = current_node.home_transitions
+                if len(home_transitions) == 0:
+                    # No custom home transition available for this node
+                    # We just go back to node #0
+                    self.reset_to_node(0)
+                else:
+                    self.walk_to_node(home_transitions[0].to_index)
+                return
@@ -0,0 +1,178 @@
+import random
+from array import array
+from typing import Iterable, List
+
+from .utils import Buttons, ControlSettings
+
+class PlaythroughSimulator:
+    """
+    Headless playthroughs of a story, for QA.
+
+    Walks the node table the way StoryPlayer does (single transitions are followed,
+    choices are browsed with the wheel, OK picks, HOME goes back), but never touches
+    an asset: no file is read, nothing is displayed or played. Button presses come
+    from scripts or from a random generator.
+
+    A playthrough ends when the story does (a node without audio, or the last node
+    without transitions), when its script runs out, or after max_steps steps.
+    """
+    def __init__(self, story, max_steps: int = 1000):
+        table, nodes_index_list = story.node_table, story.nodes_index_list
+        self.count = count = len(table)
+        self.max_steps = max_steps
+
+        # plain lists, indexing them is the fastest thing python does
+        self.has_audio = [si != -1 for si in table.si_index]
+        self.next_start, self.next_count = self.__transitions(
+            table.next_index, table.next_count, table.next_selected, nodes_index_list)
+        self.home_start, self.home_count = self.__transitions(
+            table.home_index, table.home_count, table.home_selected, nodes_index_list)
+
+        # buttons accepted while browsing a choice, from the controls of its first option
+        self.allowed = [self.__allowed_buttons(flags) for flags in table.controls]
+
+        self.visits = array('l', [0]) * count
+
+    def __transitions(self, indexes, counts, selected, nodes_index_list):
+        starts, lengths = [0] * self.count, [0] * self.count
+        for i in range(self.count):
+            if indexes[i] == -1 or counts[i] == -1 or selected[i] == -1:
+                continue
+            if 0 <= indexes[i] < len(nodes_index_list):
+                starts[i], lengths[i] = nodes_index_list[indexes[i]], counts[i]
+        return starts, lengths
+
+    @staticmethod
+    def __allowed_buttons(flags):
+        controls = ControlSettings(flags)
+        buttons = []
+        if controls.wheel:
+            buttons += [Buttons.PLUS, Buttons.MINUS]
+        if controls.ok:
+            buttons.append(Buttons.OK)
+        if controls.home:
+            buttons.append(Buttons.HOME)
+        return tuple(buttons)
+
+    def play(self, next_input) -> tuple:
+        """
+        One playthrough from node #0. next_input(allowed_buttons) returns the next
+        button pressed, or None to stop there.
+        Returns (path length in nodes, True if the story ended by itself).
+        """
+        count, visits = self.count, self.visits
+        has_audio, allowed = self.has_audio, self.allowed
+        next_start, next_count = self.next_start, self.next_count
+        home_start, home_count = self.home_start, self.home_count
+
+        index, length = 0, 0
+        for _ in range(self.max_steps):
+            if not 0 <= index < count:
+                # broken transition
+                return length, True
+            visits[index] += 1
+            length += 1
+
+            if not has_audio[index]:
+                return length, True
+
+            options = next_count[index]
+            if options == 0:
+                # out of transitions, advancing to the next node like StoryPlayer does
+                if index + 1 >= count:
+                    return length, True
+                index += 1
+                continue
+            if options == 1:
+                index = next_start[index]
+                continue
+
+            first = seek = next_start[index]
+            last = first + options - 1
+            buttons = allowed[first] if 0 <= first < count else ()
+            if not buttons:
+                # nothing can be pressed, the player would wait forever
+                return length, False
+            # a broken choice range can go past the table, those options are never counted
+            if 0 <= seek < count:
+                visits[seek] += 1
+
+            while True:
+                button = next_input(buttons)
+                if button is None:
+                    return length, False
+                if button == Buttons.PLUS:
+                    if seek < last:
+                        seek += 1
+                        if 0 <= seek < count:
+                            visits[seek] += 1
+                elif button == Buttons.MINUS:
+                    if seek > first:
+                        seek -= 1
+                        if 0 <= seek < count:
+                            visits[seek] += 1
+                elif button == Buttons.OK:
+                    # the option audio was played while browsing
+                    index = seek
+                    break
+                elif button == Buttons.HOME:
+                    index = home_start[index] if home_count[index] else 0
+                    break
+
+        return length, False
+
+    def play_script(self, buttons: Iterable[str]) -> tuple:
+        """
+        One playthrough pressing the given buttons in order. Buttons not accepted
+        by the current node are skipped, as the player ignores them.
+        """
+        pressed = iter(buttons)
+
+        def next_input(allowed):
+            for button in pressed:
+                if button in allowed:
+                    return button
+            return None
+
+        return self.play(next_input)
+
+    def play_random(self, rnd: random.Random) -> tuple:
+        """
+        One playthrough pressing random buttons among the accepted ones
+        """
+        choice = rnd.choice
+        return self.play(choice)
+
+    def simulate(self, runs: int = 1000, scripts: Iterable[Iterable[str]] | None = None, seed: int = 0) -> dict:
+        """
+        Runs every script, or `runs` random playthroughs, and reports the node coverage.
+        Visit counts accumulate in `visits` across calls, reset() clears them.
+        """
+        lengths, ended = [], 0
+        if scripts is not None:
+            for script in scripts:
+                length, done = self.play_script(script)
+                lengths.append(length)
+                ended += done
+        else:
+            rnd = random.Random(seed)
+            for _ in range(runs):
+                length, done = self.play_random(rnd)
+                lengths.append(length)
+                ended += done
+
+        never_visited = self.never_visited()
+        return {
+            'runs': len(lengths),
+            'ended': ended,
+            'truncated': len(lengths) - ended,
+            'average_path_length': sum(lengths) / len(lengths) if lengths else 0.0,
+            'coverage': (self.count - len(never_visited)) / self.count if self.count else 0.0,
+            'never_visited': never_visited,
+        }
+
+    def never_visited(self) -> List[int]:
+        return [index for index, visits in enumerate(self.visits) if visits == 0]
+
+    def reset(self):
+        self.visits = array('l', [0]) * self.count
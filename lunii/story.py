@@ -1,13 +1,33 @@
 import os
 
 from .utils import Decryption, ByteBuffer
-from .utils import ImageAsset, AudioAsset
-from .utils import ActionNode, StageNode, ControlSettings, Transition
+from .utils import ImageAsset, AudioAsset, AssetCache
+from .utils import NodeTable, StageNodes
 from .utils import StoryMetadata
+from .cache import StoryCache, story_fingerprint
+from .graph import StoryGraph
+from .dedup import AssetIndex
+from .export import open_writer, export_files, describe_story, dump_json
+from .verify import is_authorized
+from .instrument import span
+
+# how much of a story is read when it is created:
+#   full    the whole node graph and the assets indexes
+#   header  ni header, night mode, authorization and title only, the rest is loaded on first use
+DEPTHS = ("full", "header")
 
 class Story:
-    def __init__(self, path, uuid, keys:tuple):
+    def __init__(self, path, uuid, keys:tuple, asset_cache:AssetCache|None=None, story_cache:StoryCache|None=None,
+                 asset_index:AssetIndex|None=None, depth="full"):
+        if depth not in DEPTHS:
+            raise ValueError(f"Unknown depth: {depth} (expected one of {', '.join(DEPTHS)})")
+        self.depth = depth
+        self.__loading = False
+
         self.mountpoint = path
+        self.asset_cache = asset_cache
+        self.asset_index = asset_index
+        self.story_cache = story_cache
 
         self.full_uuid = uuid
         self.uuid = uuid.hex[-8:].upper()
@@ -16,6 +36,8 @@ class Story:
         self.__lunii_generic_key = keys[1]
 
         self.version, self.night_mode, self.authorized = None, False, False
+        self.nodes_count, self.image_assets_count, self.sound_assets_count = 0, 0, 0
+        self.factory_disabled = False
         self.__si, self.__ri, self.__li = [], [], []     
 
         self.__ri_path = self.__get_local_filepath('ri')
@@ -29,24 +51,203 @@ class Story:
         self.__sf_path = self.__get_local_filepath('sf/')
 
         self.nodes_index_list = []
+        self.node_table = None
         self.stage_nodes = {}
+        self.__graph = None
 
         self.cover_audio = None
 
         self.populate()
 
     def populate(self):
-        self.__verify_auth()
-        self.__get_story_metadata()
-        self.__get_story_title()
-        self.__get_songs_index()
-        self.__get_resources_index()
-
-        self.__get_list_node_index()
-        self.__get_action_node_index()
-
+        with span('story.populate', uuid=self.uuid, depth=self.depth):
+            self.__populate()
+
+    def __populate(self, header_done=False):
+        if self.depth == "header" and not header_done:
+            self.__run_phases(
+                ('verify_auth', self.__verify_auth),
+                ('metadata', self.__get_story_metadata),
+                ('title', self.__get_story_title),
+            )
+            return
+
+        fingerprint = None
+        if self.story_cache is not None:
+            # a warm cache only costs a stat of the story files
+            with span('story.cache_get'):
+                fingerprint = story_fingerprint(self.__get_local_filepath(''), self.__device_key)
+                state = self.story_cache.get(self.full_uuid, fingerprint)
+            if state is not None:
+                self.__set_state(state)
+                if not header_done:
+                    self.__run_phases(('title', self.__get_story_title))
+                self.__run_phases(('cover_audio', self.__get_cover_audio))
+                return
+
+        if not header_done:
+            self.__run_phases(
+                ('verify_auth', self.__verify_auth),
+                ('metadata', self.__get_story_metadata),
+                ('title', self.__get_story_title),
+            )
+        self.__run_phases(
+            ('si_index', self.__get_songs_index),
+            ('ri_index', self.__get_resources_index),
+            ('li_index', self.__get_list_node_index),
+            ('node_index', self.__get_action_node_index),
+            ('cover_audio', self.__get_cover_audio),
+        )
+
+        if self.story_cache is not None:
+            with span('story.cache_put'):
+                self.story_cache.put(self.full_uuid, fingerprint, self.__get_state())
+
+    def __run_phases(self, *phases):
+        # every step of the parsing is a span, when instrumentation is on
+        for name, phase in phases:
+            with span('story.' + name):
+                phase()
+
+    def load(self):
+        """
+        Completes the parsing of a story created with depth="header".
+        Happens on its own when the nodes or the cover audio are first accessed.
+        The header is not read again. If the parsing fails, the story stays
+        header-only and the next access tries again.
+        """
+        if self.depth == "full" or self.__loading:
+            return
+        # the parsing goes through the properties that call load()
+        self.__loading = True
+        try:
+            with span('story.populate', uuid=self.uuid, depth="full"):
+                self.__populate(header_done=True)
+        finally:
+            self.__loading = False
+        self.depth = "full"
+
+    @property
+    def nodes_index_list(self):
+        self.load()
+        return self.__nodes_index_list
+
+    @nodes_index_list.setter
+    def nodes_index_list(self, value):
+        self.__nodes_index_list = value
+
+    @property
+    def node_table(self):
+        self.load()
+        return self.__node_table
+
+    @node_table.setter
+    def node_table(self, value):
+        self.__node_table = value
+
+    @property
+    def stage_nodes(self):
+        self.load()
+        return self.__stage_nodes
+
+    @stage_nodes.setter
+    def stage_nodes(self, value):
+        self.__stage_nodes = value
+
+    @property
+    def cover_audio(self):
+        self.load()
+        return self.__cover_audio
+
+    @cover_audio.setter
+    def cover_audio(self, value):
+        self.__cover_audio = value
+
+    def __get_state(self):
+        return {
+            'version': self.version,
+            'nodes_count': self.nodes_count,
+            'image_assets_count': self.image_assets_count,
+            'sound_assets_count': self.sound_assets_count,
+            'factory_disabled': self.factory_disabled,
+            'night_mode': self.night_mode,
+            'authorized': self.authorized,
+            'si': self.__si,
+            'ri': self.__ri,
+            'li': self.nodes_index_list,
+            'node_table': self.node_table,
+        }
+
+    def __set_state(self, state):
+        self.version = state['version']
+        self.nodes_count = state['nodes_count']
+        self.image_assets_count = state['image_assets_count']
+        self.sound_assets_count = state['sound_assets_count']
+        self.factory_disabled = state['factory_disabled']
+        self.night_mode = state['night_mode']
+        self.authorized = state['authorized']
+        self.__si = state['si']
+        self.__ri = state['ri']
+        self.nodes_index_list = state['li']
+        self.node_table = state['node_table']
+        self.stage_nodes = StageNodes(self.node_table, self.nodes_index_list, self._get_node_assets)
+
+    def attach_asset_cache(self, asset_cache:AssetCache|None, asset_index:AssetIndex|None=None):
+        # assets already materialized are dropped, so they get recreated with the new cache
+        self.asset_cache = asset_cache
+        self.asset_index = asset_index
+        if self.depth == "header":
+            # nothing materialized yet
+            return
+        if isinstance(self.stage_nodes, StageNodes):
+            self.stage_nodes = StageNodes(self.node_table, self.nodes_index_list, self._get_node_assets)
         self.__get_cover_audio()
 
+    @property
+    def graph(self) -> StoryGraph:
+        """
+        Graph of the story transitions, built on first access
+        """
+        if self.__graph is None or self.__graph.count != len(self.node_table):
+            self.__graph = StoryGraph(self.node_table, self.nodes_index_list)
+        return self.__graph
+
+    def asset_paths(self):
+        """
+        Paths of every image and sound referenced by the story indexes
+        """
+        self.load()
+        return {
+            'image': [self.__rf_path + name.replace("\\", "/") for name in self.__ri],
+            'audio': [self.__sf_path + name.replace("\\", "/") for name in self.__si],
+        }
+
+    def export(self, path, format="zip", workers=4):
+        """
+        Writes the deciphered images and sounds of the story, and a story.json
+        describing its node graph, to a zip archive or a folder (format "zip" or "dir").
+        Assets are streamed in batches, the story itself isn't loaded in memory.
+        Folders are written by `workers` threads, zip archives sequentially (`workers` is ignored).
+        """
+        with open_writer(path, format) as writer:
+            self._export_to(writer, workers=workers)
+
+    def _export_to(self, writer, prefix='', workers=4):
+        self.load()
+        # rf/ and sf/ layouts are kept, with file extensions
+        images = ['rf/' + name.replace("\\", "/") + '.bmp' for name in self.__ri]
+        audio = ['sf/' + name.replace("\\", "/") + '.mp3' for name in self.__si]
+        paths = self.asset_paths()
+
+        files = {}
+        for name, path in zip(images, paths['image']):
+            files.setdefault(prefix + name, (path, self.__lunii_generic_key))
+        for name, path in zip(audio, paths['audio']):
+            files.setdefault(prefix + name, (path, None))
+
+        export_files(writer, ((name, path, key) for name, (path, key) in files.items()), workers)
+        writer.add_bytes(prefix + 'story.json', dump_json(describe_story(self, images, audio)))
+
     def __get_cover_audio(self):
         # reference to AudioAsset of node #0
         node = self.stage_nodes.get(0,None)
@@ -56,12 +257,13 @@ class Story:
             self.cover_audio = None
 
     def __get_story_metadata(self):
-        with open(self.__ni_path, 'rb') as fp_ni:
-            ni = fp_ni.read(512)
-            buffer = ByteBuffer(ni, '<')
-            s1 = buffer.get_short()  # read the first short integer
-            s2 = buffer.get_short()  # read the second short integer
-            self.version = s2
+        # only the ni header, nodes are read by __get_action_node_index
+        header = NodeTable.read_header(self.__ni_path)
+        self.version = header['version']
+        self.nodes_count = header['count']
+        self.image_assets_count = header['image_assets_count']
+        self.sound_assets_count = header['sound_assets_count']
+        self.factory_disabled = header['factory_disabled']
 
         # night mode is enabled if the file exists
         self.night_mode = os.path.exists(self.__nm_path)
@@ -103,13 +305,6 @@ class Story:
                     loop_again = False
             self.__ri = str_list
 
-    def __get_abs_node_idx(self, node_idx):
-        if node_idx < 0:
-            return -1
-        else:
-            return self.nodes_index_list[node_idx]
-    
-
     def __get_list_node_index(self):
         # List Node Index
         # The file is organized as an array of 4 bytes integers
@@ -126,121 +321,37 @@ class Story:
 
 
     def __get_action_node_index(self):
-        self.stage_nodes = {}
-        action_nodes_options_count = {}
-        transitions_with_action = {}
+        # the whole node table is decoded at once,
+        # stage nodes are views over it, created when looked up
+        self.node_table = NodeTable.from_file(self.__ni_path)
+        self.stage_nodes = StageNodes(self.node_table, self.nodes_index_list, self._get_node_assets)
 
-        # use ByteBuffer to read the file
-        # open ni as rb
-        
-        fp_ni = open(self.__ni_path, 'rb')
+    def _get_node_assets(self, ri_index, si_index):
+        assets = {
+            'image': None,
+            'audio': None
+        }
 
-        bb = ByteBuffer(fp_ni.read(), '<')
-        
-        # Nodes index file format version (1)
-        bb.get_short()
-
-        # Story pack version
-        version = bb.get_short()
-        # Start of actual nodes list in this file (0x200 / 512)
-
-        nodes_list = bb.get_int()
-        # Size of a stage node in this file (0x2C / 44)
-
-        node_size = bb.get_int()
-        # Number of stage nodes in this file
-
-        stage_nodes_count = bb.get_int()
-        # Number of images (in RI file and rf/ folder)
-
-        image_assets_count = bb.get_int()
-        # Number of sounds (in SI file and sf/ folder)
-
-        sound_assets_count = bb.get_int()
-        # Is factory pack (boolean) set to true to avoid pack inspection by official Luniistore application
-
-        factory_disabled = bb.get() != 0x00
-
-        for i in range(stage_nodes_count):
-            fp_ni.seek(0x200 + (i * node_size))
-            bb = ByteBuffer(fp_ni.read(node_size), '<')
-
-            ri_index = bb.get_int() # index in ri file
-            si_index = bb.get_int() # index in si file
-
-            next_node_index = bb.get_int() # index loaded from li for next in ni
-            next_nodes_count = bb.get_int() # how many choices for next_node?
-            # Choices Range = next_node_index -> next_node_index + next_nodes_count
-            next_node_selected = bb.get_int() # huh... always 0 for some reason?
-
-            home_node_index = bb.get_int()
-            home_nodes_count = bb.get_int()
-            home_node_selected = bb.get_int() # to ignore too
-
-            controls = {
-                'wheel': bb.get_short() != 0,
-                'ok': bb.get_short() != 0,
-                'home': bb.get_short() != 0,
-                'pause': bb.get_short() != 0,
-                'autoplay': bb.get_short() != 0
-            }
-
-            next_transitions = []
-            if next_node_index != -1 and next_nodes_count != -1 and next_node_selected != -1:
-                for count in range(next_nodes_count):
-                    next_transitions.append(Transition(self.__get_abs_node_idx(next_node_index) + count))
-
-            home_transitions = []
-            if home_node_index != -1 and home_nodes_count != -1 and home_node_selected != -1:
-                for count in range(home_nodes_count):
-                    home_transitions.append(Transition(self.__get_abs_node_idx(home_node_index) + count))
-
-            assets = {
-                'image': None,
-                'audio': None
-            }
-
-            if ri_index != -1:
-                image_path = self.__rf_path + self.__ri[ri_index].replace("\\", "/")
-                key = self.__lunii_generic_key
-                assets['image'] = ImageAsset('image/bmp', image_path, key)
-
-            audio = None
-            if si_index != -1:
-                audio_path = self.__sf_path + self.__si[si_index].replace("\\", "/")
-                assets['audio'] = AudioAsset('audio/mpeg', audio_path)
-
-            stage_node = StageNode(
-                i,
-                assets,
-                next_transitions,
-                home_transitions,
-                ControlSettings(controls),
-            )
-            self.stage_nodes[i] = stage_node
+        if ri_index != -1:
+            image_path = self.__rf_path + self.__ri[ri_index].replace("\\", "/")
+            key = self.__lunii_generic_key
+            assets['image'] = ImageAsset('image/bmp', image_path, key, self.asset_cache, self.__cache_key(image_path))
 
-        li_fp = Decryption(self.__lunii_generic_key, path=self.__li_path).result.buffer
-        li_bb = ByteBuffer(li_fp.read(), '<')
+        if si_index != -1:
+            audio_path = self.__sf_path + self.__si[si_index].replace("\\", "/")
+            assets['audio'] = AudioAsset('audio/mpeg', audio_path, self.asset_cache, cache_key=self.__cache_key(audio_path))
 
-       
+        return assets
 
+    def __cache_key(self, path):
+        # identical files across stories share one cache entry
+        return self.asset_index.key(path) if self.asset_index is not None else path
 
     def __verify_auth(self):
         # bt file is encrypted with the device key
         # It is made by ciphering the 0x40 first bytes for .ri file with device specific key.
-
         try:
-            with open(self.__bt_path, 'rb') as fp_bt:
-                bt = fp_bt.read()
-            with open(self.__ri_path, 'rb') as fp_ri:
-                ri = fp_ri.read(0x40)
-
-            dec = Decryption(self.__device_key, bytes=bt).result.bytes
-
-            if dec == ri:
-                self.authorized = True
-            else:
-                self.authorized = False
-        except:
+            self.authorized = is_authorized(self.__bt_path, self.__ri_path, self.__device_key)
+        except (OSError, ValueError):
+            # missing, unreadable, or not a multiple of 4 bytes
             self.authorized = False
-
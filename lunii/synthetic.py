@@ -0,0 +1,140 @@
+# Synthetic Lunii dumps, for tests and benchmarks
+#
+# Generates a fake mountpoint laid out like a real device:
+#   .md                          firmware version, SNU and the device key (encrypted with the generic key)
+#   .pi                          list of installed packs UUIDs
+#   .content/<id>/ni             stage nodes index
+#   .content/<id>/li ri si       list nodes, images and sounds indexes (encrypted with the generic key)
+#   .content/<id>/bt             authorization, first 0x40 bytes of ri encrypted with the device key
+#   .content/<id>/nm             night mode marker (some packs only)
+#   .content/<id>/rf/ sf/        BMP images (encrypted with the generic key) and MP3 sounds
+#
+# Every pack is made of a cover node, a menu of `options` choice nodes, and
+# for each choice a story node that goes back to the menu once played. With
+# `fan_out`, story nodes only go back to the first `fan_out` choices, so large
+# packs keep a bounded number of transitions per node.
+
+import os
+import struct
+import random
+from uuid import UUID
+
+import xxtea
+
+from .device import RAW_KEY_GENERIC
+
+GENERIC_KEY = b''.join(k.to_bytes(4, 'little') for k in RAW_KEY_GENERIC)
+
+def encrypt(data: bytes, key: bytes) -> bytes:
+    # same number of rounds as the device uses for decryption
+    return xxtea.encrypt(data, key, padding=False, rounds=int(1 + 52 / (len(data) / 4)))
+
+def encrypt_file(data: bytes, key: bytes) -> bytes:
+    # only the first 0x200 bytes of a file are ciphered
+    return encrypt(data[:0x200], key) + data[0x200:]
+
+def make_bmp(width: int, height: int, seed: int) -> bytes:
+    """
+    Uncompressed 4 bits BMP, with a 16 colors greyscale palette
+    """
+    row_size = ((width * 4 + 31) // 32) * 4
+    palette = b''.join(bytes((i * 17, i * 17, i * 17, 0)) for i in range(16))
+    pixels = b''.join(
+        bytes(((x + y + seed) & 0x0F) << 4 | ((x + y + seed + 1) & 0x0F) for x in range(row_size))
+        for y in range(height)
+    )
+    # pixels start 4 bytes aligned, so small images can still be ciphered as a whole
+    offset = 14 + 40 + len(palette) + 2
+
+    file_header = struct.pack('<2sIHHI', b'BM', offset + len(pixels), 0, 0, offset)
+    info_header = struct.pack('<IiiHHIIiiII', 40, width, height, 1, 4, 0, len(pixels), 2835, 2835, 16, 0)
+    return file_header + info_header + palette + b'\0\0' + pixels
+
+def make_story(path: str, device_key: bytes, options: int = 4, image_size: tuple = (64, 48),
+               audio_size: int = 2048, night_mode: bool = False, authorized: bool = True,
+               rnd: random.Random | None = None, fan_out: int | None = None):
+    rnd = rnd or random.Random(0)
+    os.makedirs(os.path.join(path, 'rf', '000'), exist_ok=True)
+    os.makedirs(os.path.join(path, 'sf', '000'), exist_ok=True)
+
+    nodes_count = 1 + 2 * options
+    names = [f'{i:08X}' for i in range(nodes_count)]
+
+    for i, name in enumerate(names):
+        with open(os.path.join(path, 'rf', '000', name), 'wb') as fp:
+            fp.write(encrypt_file(make_bmp(*image_size, seed=i), GENERIC_KEY))
+        with open(os.path.join(path, 'sf', '000', name), 'wb') as fp:
+            fp.write(rnd.randbytes(audio_size))
+
+    # resources and sounds indexes share the same names, as 12 bytes strings
+    index = b''.join(f'000\\{name}'.encode() for name in names)
+    ri = encrypt_file(index, GENERIC_KEY)
+    with open(os.path.join(path, 'ri'), 'wb') as fp:
+        fp.write(ri)
+    with open(os.path.join(path, 'si'), 'wb') as fp:
+        fp.write(encrypt_file(index, GENERIC_KEY))
+
+    bt = encrypt(ri[:0x40], device_key if authorized else rnd.randbytes(16))
+    with open(os.path.join(path, 'bt'), 'wb') as fp:
+        fp.write(bt)
+
+    if night_mode:
+        open(os.path.join(path, 'nm'), 'wb').close()
+
+    # li: [0] menu, [1 + i] story of option i
+    li = [1] + [1 + options + i for i in range(options)]
+    with open(os.path.join(path, 'li'), 'wb') as fp:
+        fp.write(encrypt_file(struct.pack(f'<{len(li)}i', *li), GENERIC_KEY))
+
+    back_count = options if fan_out is None else min(options, fan_out)
+    node = struct.Struct('<8i5h2x')
+    nodes = [
+        # cover, leads to the menu
+        node.pack(0, 0, 0, options, 0, -1, -1, -1, 1, 1, 0, 0, 0),
+    ]
+    for i in range(options):
+        # menu option, ok leads to its story, home to the cover
+        nodes.append(node.pack(1 + i, 1 + i, 1 + i, 1, 0, -1, -1, -1, 1, 1, 1, 0, 0))
+    for i in range(options):
+        # story, autoplays back to the menu
+        nodes.append(node.pack(1 + options + i, 1 + options + i, 0, back_count, 0, 0, back_count, 0, 0, 0, 1, 1, 1))
+
+    header = struct.pack('<hhiiiiiB', 1, 1, 0x200, node.size, nodes_count, nodes_count, nodes_count, 0)
+    with open(os.path.join(path, 'ni'), 'wb') as fp:
+        fp.write(header.ljust(0x200, b'\0') + b''.join(nodes))
+
+def make_device(path: str, packs: int = 10, options: int = 4, image_size: tuple = (64, 48),
+                audio_size: int = 2048, seed: int = 0, fan_out: int | None = None) -> list[UUID]:
+    """
+    Writes a synthetic device dump at `path`, and returns the UUIDs of its packs
+    """
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+
+    device_key = rnd.randbytes(16)
+    md = bytearray(0x200)
+    md[6:8] = (2).to_bytes(2, 'little')     # firmware major
+    md[8:10] = (1).to_bytes(2, 'little')    # firmware minor
+    md[10:18] = rnd.getrandbits(64).to_bytes(8, 'little')  # SNU
+    # the device reorders the key halves after decryption
+    md[0x100:0x200] = encrypt(device_key[8:16] + device_key[0:8] + bytes(0xF0), GENERIC_KEY)
+    with open(os.path.join(path, '.md'), 'wb') as fp:
+        fp.write(md)
+
+    uuids = [UUID(int=rnd.getrandbits(128)) for _ in range(packs)]
+    with open(os.path.join(path, '.pi'), 'wb') as fp:
+        fp.write(b''.join(uuid.bytes for uuid in uuids))
+
+    for i, uuid in enumerate(uuids):
+        make_story(
+            os.path.join(path, '.content', uuid.hex[-8:].upper()),
+            device_key,
+            options=options,
+            image_size=image_size,
+            audio_size=audio_size,
+            night_mode=i % 3 == 0,
+            rnd=rnd,
+            fan_out=fan_out,
+        )
+
+    return uuids
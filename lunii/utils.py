@@ -1,35 +1,132 @@
 import io
 import os
+import re
+import mmap
 import json
-import time
 import struct
-import requests
+import threading
+from importlib import resources
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
 from typing import Dict, List, Optional, Union, Tuple
 
-import vlc
 import xxtea
-import climage
-from PIL import Image
 from appdirs import AppDirs
 
-from pkg_resources import resource_stream
+from . import instrument
+
+# vlc, PIL, climage and requests are only imported where they are used,
+# so that `import lunii` stays cheap for jobs that never play or display anything
+
+class DecryptedStream(io.RawIOBase):
+    """
+    Read-only file-like object over a ciphered file.
+    The deciphered first block is served from memory, and the tail
+    (stored in plaintext) straight from an mmap of the file, without copies.
+    """
+    def __init__(self, header: bytes, mm: mmap.mmap | None, tail_offset: int):
+        super().__init__()
+        self.header = header
+        self.__mmap = mm
+        self.tail = memoryview(mm)[tail_offset:] if mm is not None else memoryview(b'')
+        self.__size = len(header) + len(self.tail)
+        self.__pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def __len__(self):
+        return self.__size
+
+    def tell(self):
+        return self.__pos
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            pos = offset
+        elif whence == 1:
+            pos = self.__pos + offset
+        elif whence == 2:
+            pos = self.__size + offset
+        else:
+            raise ValueError("Invalid whence argument")
+        if pos < 0:
+            raise ValueError("Invalid offset argument")
+        self.__pos = pos
+        return pos
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        out = memoryview(b).cast('B')
+        written = 0
+        header_len = len(self.header)
+
+        if self.__pos < header_len:
+            chunk = self.header[self.__pos:self.__pos + len(out)]
+            out[:len(chunk)] = chunk
+            written = len(chunk)
+
+        tail_pos = self.__pos + written - header_len
+        if written < len(out) and tail_pos < len(self.tail):
+            chunk = self.tail[tail_pos:tail_pos + len(out) - written]
+            out[written:written + len(chunk)] = chunk
+            written += len(chunk)
+
+        self.__pos += written
+        return written
+
+    def chunks(self, size: int = 1024 * 1024):
+        """
+        Yields the plaintext as buffers (memoryview slices for the tail)
+        """
+        yield self.header
+        for offset in range(0, len(self.tail), size):
+            yield self.tail[offset:offset + size]
+
+    def getvalue(self) -> bytes:
+        return self.header + self.tail
+
+    def close(self):
+        if self.closed:
+            return
+        self.tail.release()
+        if self.__mmap is not None:
+            try:
+                self.__mmap.close()
+            except BufferError:
+                # slices handed out by chunks() are still alive, the mmap goes with them
+                pass
+        super().close()
 
 class DecryptionResult:
-    def __init__(self, bytes):
-        if bytes is None:
+    def __init__(self, bytes, stream: DecryptedStream | None = None):
+        if bytes is None and stream is None:
             self.status = False
         else:
             self.status = True
 
-        self.bytes = bytes
-        self.buffer = io.BytesIO(bytes)
+        self.stream = stream
+        self.__bytes = bytes
+        self.buffer = stream if stream is not None else io.BytesIO(bytes)
+
+    @property
+    def bytes(self):
+        # a streamed result is only concatenated if its bytes are asked for
+        if self.__bytes is None and self.stream is not None:
+            self.__bytes = self.stream.getvalue()
+        return self.__bytes
 
 
 class Decryption:
     def __lunii_tea_rounds(self, buffer):
-        return int(1 + 52 / (len(buffer)/4))
+        return lunii_tea_rounds(len(buffer))
     
-    def __init__(self, key, padding=None, rounds=None, path=None, bytes=None):
+    def __init__(self, key, padding=None, rounds=None, path=None, bytes=None, stream=False):
         self.key = key
         self.padding = padding
         self.rounds = rounds
@@ -39,32 +136,153 @@ class Decryption:
         #check if path or bytes is set
         if path is None:
             #decrypted = xxtea.decrypt(bytes, self.key, padding=False, rounds=self.__lunii_tea_rounds(bytes))
+            instrument.count('bytes_decrypted', len(bytes))
             self.result = DecryptionResult(
                 xxtea.decrypt(bytes, self.key, padding=False, rounds=self.__lunii_tea_rounds(bytes))
             )
             return
 
+        elif stream:
+            self.result = self.__decrypt_stream(path)
+            return
+
         else:
-            fp = open(path, 'rb')
+            with open(path, 'rb') as fp:
+                # processing first block
+                ciphered = fp.read(0x200)
+                if len(ciphered) == 0:
+                    instrument.count('file_opens')
+                    return
 
-            # processing first block
-            ciphered = fp.read(0x200)
-            if len(ciphered) == 0:
-                return
-            
-            decrypted = xxtea.decrypt(ciphered, self.key, padding=False, rounds=self.__lunii_tea_rounds(ciphered))
+                decrypted = xxtea.decrypt(ciphered, self.key, padding=False, rounds=self.__lunii_tea_rounds(ciphered))
 
-            # check if left over bytes, that are already decrypted
-            left = fp.read()
-            if len(left) != 0:
-                decrypted += left
+                # check if left over bytes, that are already decrypted
+                left = fp.read()
+                if len(left) != 0:
+                    decrypted += left
 
-            fp.close()
+            instrument.count('file_opens')
+            instrument.count('bytes_read', len(ciphered) + len(left))
+            instrument.count('bytes_decrypted', len(ciphered))
 
             self.result = DecryptionResult(decrypted)
 
             return
 
+    def __decrypt_stream(self, path):
+        with open(path, 'rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if size == 0:
+                return DecryptionResult(None)
+
+            ciphered = fp.read(0x200)
+            # the mapping stays valid once the file is closed
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) if size > len(ciphered) else None
+
+        # the tail is mapped, its pages are read when used
+        instrument.count('file_opens')
+        instrument.count('bytes_read', len(ciphered))
+        instrument.count('bytes_mapped', size - len(ciphered))
+        instrument.count('bytes_decrypted', len(ciphered))
+
+        try:
+            decrypted = xxtea.decrypt(ciphered, self.key, padding=False, rounds=self.__lunii_tea_rounds(ciphered))
+            return DecryptionResult(None, DecryptedStream(decrypted, mm, len(ciphered)))
+        except Exception:
+            if mm is not None:
+                mm.close()
+            raise
+
+XXTEA_DELTA = 0x9E3779B9
+
+def lunii_tea_rounds(length: int) -> int:
+    # Lunii's variant uses 1 + 52/n rounds instead of XXTEA's 6 + 52/n
+    return int(1 + 52 / (length / 4))
+
+def _decrypt_blocks_numpy(blocks: List[bytes], key: bytes) -> List[bytes]:
+    import numpy as np
+
+    n = len(blocks[0]) // 4
+    rounds = lunii_tea_rounds(len(blocks[0]))
+    k = np.frombuffer(key, '<u4').astype(np.uint32)
+
+    # one row per word position, one lane per block; copied into contiguous
+    # (and writable) rows, strided lanes are about 3 times slower to operate on
+    v = np.array(np.frombuffer(b''.join(blocks), '<u4').reshape(len(blocks), n).T, dtype=np.uint32, order='C')
+
+    total = (rounds * XXTEA_DELTA) & 0xFFFFFFFF
+    y = v[0]
+    for _ in range(rounds):
+        e = (total >> 2) & 3
+        s = np.uint32(total)
+        for p in range(n - 1, -1, -1):
+            z = v[p - 1]    # v[-1] wraps to the last word for p = 0
+            mx = (((z >> 5) ^ (y << 2)) + ((y >> 3) ^ (z << 4))) ^ ((s ^ y) + (k[(p & 3) ^ e] ^ z))
+            v[p] -= mx
+            y = v[p]
+        total = (total - XXTEA_DELTA) & 0xFFFFFFFF
+
+    plain = v.T.astype('<u4').tobytes()
+    size = len(blocks[0])
+    return [plain[i * size:(i + 1) * size] for i in range(len(blocks))]
+
+def decrypt_blocks(blocks: List[bytes], key: bytes, backend: str = "xxtea") -> List[bytes]:
+    """
+    Deciphers many blocks with the same key, results in the same order.
+    Blocks are grouped by size; each group is deciphered in one pass, either
+    by the xxtea extension ("xxtea") or by NumPy uint32 lanes ("numpy").
+    """
+    groups = {}
+    for position, block in enumerate(blocks):
+        groups.setdefault(len(block), []).append(position)
+    instrument.count('bytes_decrypted', sum(size * len(positions) for size, positions in groups.items()))
+
+    results = [None] * len(blocks)
+    for size, positions in groups.items():
+        group = [blocks[position] for position in positions]
+        if backend == "numpy":
+            decrypted = _decrypt_blocks_numpy(group, key)
+        elif backend == "xxtea":
+            rounds = lunii_tea_rounds(size)
+            decrypted = [xxtea.decrypt(block, key, padding=False, rounds=rounds) for block in group]
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
+        for position, block in zip(positions, decrypted):
+            results[position] = block
+    return results
+
+def decrypt_files(paths: List[str], key: bytes, backend: str = "xxtea") -> List[Optional[DecryptedStream]]:
+    """
+    Streams over many ciphered files (see Decryption(stream=True)), their first
+    blocks being deciphered together by decrypt_blocks(). Empty files give None.
+    """
+    headers, maps = [], []
+    try:
+        for path in paths:
+            with open(path, 'rb') as fp:
+                size = os.fstat(fp.fileno()).st_size
+                ciphered = fp.read(0x200)
+                # the mapping stays valid once the file is closed
+                mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) if size > len(ciphered) else None
+            headers.append(ciphered)
+            maps.append(mm)
+            instrument.count('file_opens')
+            instrument.count('bytes_read', len(ciphered))
+            instrument.count('bytes_mapped', size - len(ciphered))
+
+        decrypted = iter(decrypt_blocks([header for header in headers if header], key, backend))
+    except Exception:
+        for mm in maps:
+            if mm is not None:
+                mm.close()
+        raise
+
+    return [
+        DecryptedStream(next(decrypted), mm, len(header)) if header else None
+        for header, mm in zip(headers, maps)
+    ]
+
 class ByteBuffer:
     def __init__(self, data, byte_order='!'):
         self.data = data
@@ -111,6 +329,67 @@ class ByteBuffer:
         if self.offset < 0 or self.offset > len(self.data):
             raise ValueError("Invalid offset argument")
 
+class AssetCache:
+    """
+    Bounded LRU cache of asset contents, keyed by asset path.
+    The bound is expressed in total bytes held, not in number of entries.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            content = self.__entries.get(key)
+            if content is not None:
+                self.__entries.move_to_end(key)
+            return content
+
+    def put(self, key, content):
+        if content is None or len(content) > self.max_bytes:
+            return
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.__entries[key] = content
+            self.size += len(content)
+
+            # evicting least recently used entries until we fit again
+            while self.size > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, key):
+        with self.__lock:
+            content = self.__entries.pop(key, None)
+            if content is not None:
+                self.size -= len(content)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.size = 0
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+# climage settings of ImageAsset.render() modes
+RENDER_MODES = {
+    'unicode': {'is_unicode': True},
+    'ascii': {'is_unicode': False},
+    'unicode-truecolor': {'is_unicode': True, 'is_truecolor': True, 'is_256color': False},
+    'ascii-truecolor': {'is_unicode': False, 'is_truecolor': True, 'is_256color': False},
+}
+
+# marks an asset whose content has not been read yet
+_NOT_LOADED = object()
+
 class ImageAsset:
     """
     BPM Images
@@ -119,32 +398,186 @@ class ImageAsset:
     Height                                   : 240 pixels
     Color space                              : RGB
     Bit depth                                : 4 bits
+
+    Content is only read and decrypted on first access of `content`.
+    Assets with the same cache_key (identical files, see AssetIndex) share their cache entries.
     """
-    def __init__(self, image_type: str, path: str, key: str):
+    def __init__(self, image_type: str, path: str, key: str, cache: AssetCache | None = None,
+                 cache_key: str | None = None):
         self.image_type = image_type
         self.path = path
+        self.key = key
+        self.cache = cache
+        self.cache_key = cache_key or path
 
-        self.content = Decryption(key, path=path).result.bytes
-    
-    def show(self):
-        if self.content is None:
-            return
-        img = Image.open(io.BytesIO(self.content))
-        img.save('/tmp/image.png')
+        self.__content = _NOT_LOADED
 
-        # display the image
-        img = Image.open('/tmp/image.png')
-    
-        output = climage.convert('/tmp/image.png', 'ansi', width=40)
+    @property
+    def content(self):
+        if self.__content is not _NOT_LOADED:
+            return self.__content
+
+        if self.cache is not None:
+            content = self.cache.get(self.cache_key)
+            if content is None:
+                content = Decryption(self.key, path=self.path).result.bytes
+                self.cache.put(self.cache_key, content)
+            # the shared cache keeps the memory bounded, so no copy is kept here
+            return content
+
+        self.__content = Decryption(self.key, path=self.path).result.bytes
+        return self.__content
+
+    def open(self):
+        """
+        Decrypted image as a file-like object.
+        Unless already loaded, it is streamed from the file instead of being read in memory.
+        """
+        if self.__content is not _NOT_LOADED:
+            return io.BytesIO(self.__content)
+        if self.cache is not None:
+            content = self.cache.get(self.cache_key)
+            if content is not None:
+                return io.BytesIO(content)
+        return Decryption(self.key, path=self.path, stream=True).result.buffer
+
+    def render(self, width: int = 40, mode: str = 'unicode', frame_cache: AssetCache | None = None) -> str | None:
+        """
+        Terminal frame (ANSI escape codes) of the image, rendered in memory.
+        Frames are kept in frame_cache, keyed by (cache_key, width, mode).
+        """
+        key = (self.cache_key, width, mode)
+        if frame_cache is not None:
+            frame = frame_cache.get(key)
+            if frame is not None:
+                return frame
+
+        import climage
+        from PIL import Image
+
+        with self.open() as fp:
+            if fp.seek(0, io.SEEK_END) == 0:
+                return None
+            fp.seek(0)
+            # climage expects RGB pixels, 4 bits BMPs are palettized
+            img = Image.open(fp).convert('RGB')
+
+        frame = climage.convert_pil(img, width=width, **RENDER_MODES[mode])
+
+        if frame_cache is not None:
+            frame_cache.put(key, frame)
+        return frame
+
+    def show(self, width: int = 40, mode: str = 'unicode', frame_cache: AssetCache | None = None):
+        output = self.render(width, mode, frame_cache)
+        if output is None:
+            return
 
         print(output)
-        
+
     def __repr__(self):
         return f"ImageAsset({self.image_type}, {self.path})"
 
     def __str__(self):
         return f"ImageAsset({self.image_type}, {self.path})"
 
+class AudioEngine:
+    """
+    A long-lived media player, reused for every clip.
+    The end of playback is signaled by VLC's MediaPlayerEndReached event.
+
+    Engines created with shared_instance() (or any given libVLC instance) only own
+    their media player: many of them, one per playback session, share one libVLC.
+    """
+    __shared = None
+    __shared_instance = None
+    __shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        with cls.__shared_lock:
+            if cls.__shared is None:
+                cls.__shared = cls()
+            return cls.__shared
+
+    @classmethod
+    def shared_instance(cls):
+        """
+        Process-wide libVLC instance, created on first use
+        """
+        import vlc
+
+        with cls.__shared_lock:
+            if cls.__shared_instance is None:
+                cls.__shared_instance = vlc.Instance('--no-xlib')
+                if cls.__shared_instance is None:
+                    raise Exception("VLC instance failed to initialize")
+            return cls.__shared_instance
+
+    def __init__(self, *vlc_args, instance=None):
+        import vlc
+
+        # an instance given is shared with other engines, it isn't released with this one
+        self.__owns_instance = instance is None
+        self.instance = instance or vlc.Instance(*(vlc_args or ('--no-xlib',)))
+        if self.instance is None:
+            raise Exception("VLC instance failed to initialize")
+
+        self.player = self.instance.media_player_new()
+        self.current = None
+
+        self.__lock = threading.Lock()
+        self.__done = threading.Event()
+        self.__done.set()
+        self.__on_end = None
+
+        events = self.player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, self.__ended)
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError, self.__ended)
+
+    def __ended(self, event):
+        # runs in a VLC thread, libvlc must not be called from here
+        with self.__lock:
+            on_end, self.__on_end = self.__on_end, None
+            self.__done.set()
+        if on_end is not None:
+            on_end()
+
+    @property
+    def is_playing(self):
+        return not self.__done.is_set()
+
+    def play(self, path: str, on_end=None):
+        if self.is_playing:
+            self.stop()
+
+        media = self.instance.media_new(path)
+        with self.__lock:
+            self.current = path
+            self.__on_end = on_end
+            self.__done.clear()
+        self.player.set_media(media)
+        media.release()
+        self.player.play()
+
+    def wait(self, timeout=None) -> bool:
+        return self.__done.wait(timeout)
+
+    def stop(self):
+        # stopping doesn't trigger MediaPlayerEndReached, so waiters are released here
+        self.player.stop()
+        with self.__lock:
+            on_end, self.__on_end = self.__on_end, None
+            self.__done.set()
+        if on_end is not None:
+            on_end()
+
+    def release(self):
+        self.stop()
+        self.player.release()
+        if self.__owns_instance:
+            self.instance.release()
+
 class AudioAsset:
     """
     Audio
@@ -163,44 +596,61 @@ class AudioAsset:
     Writing library                          : LAME3.100
     Encoding settings                        : -m m -V 4 -q 0 -lowpass 17.5 --vbr-new -b 32
     """
-    def __init__(self, audio_type: str, path: str):
+    def __init__(self, audio_type: str, path: str, cache: AssetCache | None = None, engine=None,
+                 cache_key: str | None = None):
         self.audio_type = audio_type
         self.path = path
-        
-        with open(path, 'rb') as f:
-            self.content = f.read()
+        self.cache = cache
+        self.cache_key = cache_key or path
+        self.engine = engine
 
-    @property
-    def is_playing(self):
-        return self.player.get_state() != vlc.State.Ended
+        self.__content = _NOT_LOADED
 
-    def play(self):
-        # create a VLC instance
-        self.instance = vlc.Instance('--no-xlib')
+    @property
+    def content(self):
+        if self.__content is not _NOT_LOADED:
+            return self.__content
 
-        if self.instance is None:
-            raise Exception("VLC instance failed to initialize")
+        if self.cache is not None:
+            content = self.cache.get(self.cache_key)
+            if content is None:
+                content = self.__read()
+                self.cache.put(self.cache_key, content)
+            return content
 
-        # create a new media object
-        self.media = self.instance.media_new(self.path)
+        self.__content = self.__read()
+        return self.__content
 
-        # create a new media player
-        self.player = self.instance.media_player_new()
+    def __read(self):
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        instrument.count('file_opens')
+        instrument.count('bytes_read', len(content))
+        return content
 
-        # set the media player as the media
-        self.player.set_media(self.media)
+    @property
+    def is_playing(self):
+        return self.engine is not None and self.engine.is_playing and self.engine.current == self.path
 
-        time.sleep(0.25)
+    def play(self, on_end=None):
+        """
+        Starts playing on the shared AudioEngine (unless one was given), and returns immediately.
+        on_end() is called from a VLC thread once playback is over.
+        """
+        if self.engine is None:
+            self.engine = AudioEngine.shared()
+        self.engine.play(self.path, on_end)
 
-        # play the media
-        self.player.play()
+    def wait(self, timeout=None):
+        # blocks until the end of playback, no polling involved
+        if self.engine is None or self.engine.current != self.path:
+            return True
+        return self.engine.wait(timeout)
 
     def release(self):
-        if self.instance:
-            #release the player
-            self.player.release()
-            self.instance.release()
-        
+        # the engine is shared and outlives assets, only stops this asset if still playing
+        if self.is_playing:
+            self.engine.stop()
 
     def __repr__(self):
         return f"AudioAsset({self.audio_type}, {self.path})"
@@ -211,32 +661,250 @@ class AudioAsset:
 
 
 class Transition:
+    __slots__ = ('to_index',)
+
     def __init__(self, to_index: int):
         self.to_index = to_index
 
+class TransitionRange(Sequence):
+    """
+    Transitions to the contiguous nodes [start, start + count), as a read-only list
+    """
+    __slots__ = ('start', 'count')
+
+    def __init__(self, start: int = 0, count: int = 0):
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [Transition(self.start + j) for j in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("transition index out of range")
+        return Transition(self.start + i)
+
+    def __iter__(self):
+        for to_index in range(self.start, self.start + self.count):
+            yield Transition(to_index)
+
+    def __repr__(self):
+        return f"TransitionRange({self.start}, {self.count})"
+
 class ControlSettings:
+    """
+    Controls allowed on a node, packed as a bitfield
+    """
+    __slots__ = ('flags',)
+
+    WHEEL, OK, HOME, PAUSE, AUTOPLAY = 0x01, 0x02, 0x04, 0x08, 0x10
+
     def __init__(self, dict_controls):
-        self.wheel = dict_controls.get('wheel', False)
-        self.ok = dict_controls.get('ok', False)
-        self.home = dict_controls.get('home', False)
-        self.pause = dict_controls.get('pause', False)
-        self.autoplay = dict_controls.get('autoplay', False)
+        # either a {'wheel': bool, ...} dict, or already packed flags
+        if isinstance(dict_controls, int):
+            self.flags = dict_controls
+        else:
+            self.flags = (
+                (self.WHEEL if dict_controls.get('wheel', False) else 0) |
+                (self.OK if dict_controls.get('ok', False) else 0) |
+                (self.HOME if dict_controls.get('home', False) else 0) |
+                (self.PAUSE if dict_controls.get('pause', False) else 0) |
+                (self.AUTOPLAY if dict_controls.get('autoplay', False) else 0)
+            )
+
+    @property
+    def wheel(self):
+        return bool(self.flags & self.WHEEL)
+
+    @property
+    def ok(self):
+        return bool(self.flags & self.OK)
+
+    @property
+    def home(self):
+        return bool(self.flags & self.HOME)
+
+    @property
+    def pause(self):
+        return bool(self.flags & self.PAUSE)
+
+    @property
+    def autoplay(self):
+        return bool(self.flags & self.AUTOPLAY)
+
+class NodeTable:
+    """
+    Stage nodes of a story (ni file), decoded in a single pass into columns.
+
+    Header (0x200 bytes)
+    Nodes index file format version          : short
+    Story pack version                       : short
+    Start of actual nodes list in this file  : int (0x200)
+    Size of a stage node in this file        : int (0x2C)
+    Number of stage nodes in this file       : int
+    Number of images (in RI file and rf/)    : int
+    Number of sounds (in SI file and sf/)    : int
+    Is factory pack                          : byte
+
+    Stage node (0x2C bytes)
+    ri index, si index                       : int, int
+    next node index, count, selected         : int, int, int
+    home node index, count, selected         : int, int, int
+    wheel, ok, home, pause, autoplay         : short x5
+    """
+    HEADER = struct.Struct('<hhiiiiiB')
+    NODE_FIELDS = '<8i5h'
+
+    def __init__(self, data: bytes):
+        if len(data) < self.HEADER.size:
+            raise ValueError(f"ni header truncated: {len(data)} bytes")
+        (self.format_version, self.version, self.nodes_list, self.node_size,
+         self.count, self.image_assets_count, self.sound_assets_count,
+         factory) = self.HEADER.unpack_from(data, 0)
+        self.factory_disabled = factory != 0x00
+
+        if self.node_size < struct.calcsize(self.NODE_FIELDS):
+            raise ValueError(f"Invalid node size: {self.node_size}")
+        node_struct = struct.Struct(self.NODE_FIELDS + 'x' * (self.node_size - struct.calcsize(self.NODE_FIELDS)))
+        end = self.nodes_list + self.count * self.node_size
+        if end > len(data):
+            raise ValueError("Not enough bytes remaining in buffer")
+
+        columns = list(zip(*node_struct.iter_unpack(memoryview(data)[self.nodes_list:end])))
+        if not columns:
+            columns = [()] * 13
+
+        self.ri_index = array('i', columns[0])
+        self.si_index = array('i', columns[1])
+        self.next_index = array('i', columns[2])
+        self.next_count = array('i', columns[3])
+        self.next_selected = array('i', columns[4])
+        self.home_index = array('i', columns[5])
+        self.home_count = array('i', columns[6])
+        self.home_selected = array('i', columns[7])
+        # control flags, packed like ControlSettings in a single byte per node
+        self.controls = array('B', [
+            (wheel != 0) | (ok != 0) << 1 | (home != 0) << 2 | (pause != 0) << 3 | (autoplay != 0) << 4
+            for wheel, ok, home, pause, autoplay in zip(*columns[8:13])
+        ])
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, 'rb') as fp_ni:
+            data = fp_ni.read()
+        instrument.count('file_opens')
+        instrument.count('bytes_read', len(data))
+        return cls(data)
+
+    @classmethod
+    def read_header(cls, path: str) -> dict:
+        """
+        Header fields of an ni file, without reading its nodes
+        """
+        with open(path, 'rb') as fp_ni:
+            data = fp_ni.read(cls.HEADER.size)
+        instrument.count('file_opens')
+        instrument.count('bytes_read', len(data))
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f"ni header truncated: {len(data)} bytes")
+        (format_version, version, nodes_list, node_size,
+         count, image_assets_count, sound_assets_count, factory) = cls.HEADER.unpack(data)
+        return {
+            'format_version': format_version,
+            'version': version,
+            'nodes_list': nodes_list,
+            'node_size': node_size,
+            'count': count,
+            'image_assets_count': image_assets_count,
+            'sound_assets_count': sound_assets_count,
+            'factory_disabled': factory != 0x00,
+        }
+
+    def __len__(self):
+        return self.count
+
+class StageNodes(Mapping):
+    """
+    index -> StageNode mapping over a NodeTable.
+    StageNode objects are only created when first looked up.
+    """
+    def __init__(self, table: NodeTable, nodes_index_list: List[int], asset_factory):
+        self.table = table
+        self.nodes_index_list = nodes_index_list
+        self.asset_factory = asset_factory
+        self.__nodes = {}
+
+    def abs_index(self, node_idx: int) -> int:
+        if node_idx < 0:
+            return -1
+        return self.nodes_index_list[node_idx]
+
+    def next_transitions(self, index: int) -> TransitionRange:
+        table = self.table
+        node_index, count = table.next_index[index], table.next_count[index]
+        if node_index == -1 or count == -1 or table.next_selected[index] == -1:
+            return TransitionRange()
+        return TransitionRange(self.abs_index(node_index), count)
+
+    def home_transitions(self, index: int) -> TransitionRange:
+        table = self.table
+        node_index, count = table.home_index[index], table.home_count[index]
+        if node_index == -1 or count == -1 or table.home_selected[index] == -1:
+            return TransitionRange()
+        return TransitionRange(self.abs_index(node_index), count)
+
+    def __getitem__(self, index):
+        node = self.__nodes.get(index)
+        if node is None:
+            if not isinstance(index, int) or not 0 <= index < len(self.table):
+                raise KeyError(index)
+            node = StageNode(index, self)
+            self.__nodes[index] = node
+        return node
+
+    def __iter__(self):
+        return iter(range(len(self.table)))
+
+    def __len__(self):
+        return len(self.table)
 
 class StageNode:
-    def __init__(self,
-                 index: int,
-                 assets: dict[str,ImageAsset|AudioAsset|None] | None = None,
-                 next_transitions: List[Transition] | None = None,
-                 home_transitions: List[Transition] | None = None,
-                 control_settings: ControlSettings | None = None
-                 ):
+    """
+    View over one row of a NodeTable
+    """
+    __slots__ = ('index', 'nodes', '__assets')
+
+    def __init__(self, index: int, nodes: StageNodes):
         self.index = index
-        self.assets = assets
-        self.next_transitions = next_transitions
-        self.home_transitions = home_transitions
-        self.control_settings = control_settings
+        self.nodes = nodes
+        self.__assets = None
+
+    @property
+    def assets(self) -> dict[str,ImageAsset|AudioAsset|None]:
+        if self.__assets is None:
+            table = self.nodes.table
+            self.__assets = self.nodes.asset_factory(table.ri_index[self.index], table.si_index[self.index])
+        return self.__assets
+
+    @property
+    def next_transitions(self) -> TransitionRange:
+        return self.nodes.next_transitions(self.index)
+
+    @property
+    def home_transitions(self) -> TransitionRange:
+        return self.nodes.home_transitions(self.index)
+
+    @property
+    def control_settings(self) -> ControlSettings:
+        return ControlSettings(self.nodes.table.controls[self.index])
 
 class ActionNode:
+    __slots__ = ('options', 'metadata')
+
     def __init__(self, options, metadata):
         self.options = options
         self.metadata = {
@@ -244,55 +912,286 @@ class ActionNode:
             'choice_count': metadata['choice_count'],
         }
 
-class StoryMetadata:
-    def __init__(self, filename=None, refresh=False):
-        self.filename = filename
-        if refresh:
-            self.__fetch_metadata(
-                "https://raw.githubusercontent.com/o-daneel/Lunii.RE/main/resources/packs.json"
-            )
-        self.metadata = self.load_titles()
+def normalize_uuid(uuid) -> str:
+    return str(uuid).lower().strip('{}').replace('-', '')
+
+class TitlesIndex:
+    """
+    Titles entries indexed by normalized UUID, and by short UUID
+    (the last 8 hex chars, as used for the .content/ folder names)
+    """
+    def __init__(self, entries: list):
+        self.entries = entries
+        self.by_uuid, self.by_short = {}, {}
+
+        for entry in entries:
+            key = normalize_uuid(entry.get('uuid', ''))
+            if not key:
+                continue
+            # first entry wins, like the linear scan used to
+            self.by_uuid.setdefault(key, entry)
+            self.by_short.setdefault(key[-8:], entry)
+
+    def get(self, uuid):
+        key = normalize_uuid(uuid)
+        if len(key) == 32:
+            return self.by_uuid.get(key)
+        if len(key) == 8:
+            return self.by_short.get(key)
+
+        # partial uuids fall back to the former substring match
+        needle = str(uuid).lower()
+        for story in self.entries:
+            if needle in story['uuid'].lower():
+                return story
+        return None
+
+# process-wide titles indexes, keyed by source file (None for the packaged titles)
+# each value is a (fingerprint, TitlesIndex) tuple, fingerprint being (mtime, size)
+_titles_indexes = {}
+_titles_lock = threading.Lock()
 
-    def __fetch_metadata(self, url: str, lang: str = "fr_FR") -> None:
-        response = requests.get(url).json()
+def _load_titles_index(filename: str | None) -> TitlesIndex:
+    if filename is None:
+        fingerprint = None
+    else:
+        st = os.stat(filename)
+        fingerprint = (st.st_mtime_ns, st.st_size)
 
-        results = []
+    with _titles_lock:
+        cached = _titles_indexes.get(filename)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
 
-        for key in response["response"]:
-            entry = response["response"][key]
-            localized_infos = entry.get("localized_infos", {}).get(lang, {})
-            if not localized_infos:
+        if filename is None:
+            entries = json.loads(resources.files('lunii').joinpath('data/titles.json').read_bytes())
+        else:
+            with open(filename, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+
+        index = TitlesIndex(entries)
+        _titles_indexes[filename] = (fingerprint, index)
+        return index
+
+PACKS_URL = "https://raw.githubusercontent.com/o-daneel/Lunii.RE/main/resources/packs.json"
+
+# chars that can follow the part of a number raw_decode() consumed
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+class _JsonStream:
+    """
+    Incremental reader over JSON text chunks, decoding one value at a time
+    with json's raw_decode and only keeping the text not consumed yet.
+    """
+    def __init__(self, chunks):
+        self.__chunks = iter(chunks)
+        self.__decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def __fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = next(self.__chunks, None)
+        if chunk is None:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        # next non whitespace char, '' at the end of the stream
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.__fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of the current chunk")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # most likely cut by the end of the chunk
+                if not self.__fill():
+                    raise
+                continue
+            # a number cut by the end of the chunk ('1.' of '1.5', '1.5e' of '1.5e3')
+            # is decoded short, it is only complete once followed by something else
+            if isinstance(value, (int, float)) and not self.eof \
+                    and _NUMBER_TAIL.match(self.buffer, end).end() == len(self.buffer) and self.__fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """
+        (key, value) pairs of the object starting here
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self
+            if self.peek() == ',':
+                self.pos += 1
                 continue
+            self.expect('}')
+            return
+
+def iter_json_object(chunks, path: tuple = ()):
+    """
+    (key, value) pairs of the JSON object found at `path` (a tuple of keys) in a stream
+    of text chunks. Values are decoded one by one, the document is never held in memory.
+    """
+    stream = _JsonStream(chunks)
+
+    def walk(depth):
+        for key, _ in stream.items():
+            if depth == len(path):
+                yield key, stream.value()
+            elif key == path[depth]:
+                yield from walk(depth + 1)
             else:
-                title = localized_infos.get("title", "")
-            result = {
-                "uuid": entry.get("uuid", ""),
-                "title": title,
-                "keywords": entry.get("keywords", ""),
-                "subtitle": entry.get("subtitle", ""),
-            }
-            results.append(result)
+                stream.value()
+
+    yield from walk(0)
+
+def _decode_chunks(chunks, encoding='utf-8'):
+    import codecs
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+def titles_entry(entry: dict, lang: str = "fr_FR") -> dict | None:
+    """
+    Titles entry of a packs.json pack, with every locale kept.
+    The top level title and subtitle are those of `lang`, or of the first locale otherwise.
+    """
+    localized = entry.get("localized_infos") or {}
+    locales = {}
+    for locale, infos in localized.items():
+        if isinstance(infos, dict):
+            locales[locale] = {key: infos[key] for key in ("title", "subtitle") if infos.get(key)}
+    if not locales:
+        return None
+
+    default = locales.get(lang) or next(iter(locales.values()))
+    return {
+        "uuid": entry.get("uuid", ""),
+        "title": default.get("title", ""),
+        "keywords": entry.get("keywords", ""),
+        "subtitle": default.get("subtitle", entry.get("subtitle", "")),
+        "locales": locales,
+    }
+
+class StoryMetadata:
+    def __init__(self, filename=None, refresh=False, url=PACKS_URL):
+        self.filename = filename
+        if refresh:
+            self.refresh(url)
+        self.metadata = self.load_titles()
 
+    def refresh(self, url: str = PACKS_URL, timeout: float = 30) -> bool:
+        """
+        Downloads the titles again, unless they didn't change since the last refresh
+        (conditional request on the ETag/Last-Modified stored next to the titles file).
+        Returns True if the titles file was rewritten.
+        """
         self.filename = self.filename or os.path.join(
             AppDirs("lunii", "lunii").user_data_dir, "titles.json"
         )
-        with open(self.filename, 'w') as f:
-            json.dump(results, f, indent=4)
+        return self.__fetch_metadata(url, timeout=timeout)
+
+    def __validators_path(self):
+        return self.filename + '.http'
+
+    def __fetch_metadata(self, url: str, lang: str = "fr_FR", timeout: float = 30) -> bool:
+        import requests
+
+        validators = {}
+        if os.path.exists(self.filename):
+            try:
+                with open(self.__validators_path(), 'r') as f:
+                    validators = json.load(f)
+            except (OSError, ValueError):
+                validators = {}
+
+        headers = {}
+        if validators.get('url') == url:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 304:
+                return False
+            response.raise_for_status()
+
+            # JSON is UTF-8 (RFC 8259), whatever charset requests guesses for text/* responses
+            chunks = _decode_chunks(response.iter_content(64 * 1024), 'utf-8')
+            results = []
+            for _, entry in iter_json_object(chunks, ("response",)):
+                result = titles_entry(entry, lang)
+                if result is not None:
+                    results.append(result)
+
+            validators = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        # compact, and swapped in atomically for concurrent readers
+        tmp_path = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp_path, self.filename)
+
+        with open(self.__validators_path(), 'w') as f:
+            json.dump(validators, f)
+        return True
 
     def load_titles(self):
+        # titles are parsed once per file and shared across instances,
+        # until the file changes on disk
         self.filename = self.filename or os.path.join(
             AppDirs("lunii", "lunii").user_data_dir, "titles.json"
         )
         if os.path.exists(self.filename):
-            with open(self.filename, 'r') as f:
-                return json.load(f)
-        return json.load(resource_stream('lunii', 'data/titles.json'))
+            self.index = _load_titles_index(self.filename)
+        else:
+            self.index = _load_titles_index(None)
+        return self.index.entries
 
-    def get_metadata(self, uuid):
-        for story in self.metadata:
-            if str(uuid).lower() in story['uuid'].lower():
-                return story
-        return {}
+    def get_metadata(self, uuid, lang=None):
+        story = self.index.get(uuid)
+        if story is None:
+            return {}
+        if lang is not None and lang in story.get('locales', {}):
+            # titles of another locale than the default one
+            return {**story, **story['locales'][lang]}
+        return story
 
 class Buttons:
     PLUS = "+"
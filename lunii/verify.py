@@ -0,0 +1,121 @@
+import os
+import struct
+
+from . import instrument
+from .utils import Decryption, NodeTable
+from .cache import file_fingerprint, story_fingerprint
+
+# files a story can't be read without, in its .content/<id>/ folder
+REQUIRED_FILES = ('ni', 'li', 'ri', 'si', 'bt')
+REQUIRED_FOLDERS = ('rf', 'sf')
+
+# verification statuses, by order of precedence
+AUTHORIZED, UNAUTHORIZED, CORRUPT, MISSING = 'authorized', 'unauthorized', 'corrupt', 'missing'
+
+def is_authorized(bt_path: str, ri_path: str, device_key: bytes) -> bool:
+    """
+    bt is the first 0x40 bytes of ri, ciphered with the device key.
+    Raises OSError if a file can't be read, ValueError if bt can't be deciphered.
+    """
+    with open(bt_path, 'rb') as fp_bt:
+        bt = fp_bt.read()
+    with open(ri_path, 'rb') as fp_ri:
+        ri = fp_ri.read(0x40)
+    instrument.count('file_opens', 2)
+    instrument.count('bytes_read', len(bt) + len(ri))
+    if not bt:
+        return False
+    return Decryption(device_key, bytes=bt).result.bytes == ri
+
+def verification_fingerprint(story_path: str, device_key: bytes) -> tuple:
+    """
+    story_fingerprint() of a story, plus the size and mtime of its rf/ and sf/
+    folders and of their subfolders, which change when assets are added, removed or replaced.
+    """
+    folders = []
+    for name in REQUIRED_FOLDERS:
+        folder = os.path.join(story_path, name)
+        folders.append((name, file_fingerprint(folder)))
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        folders.append((f"{name}/{entry.name}", file_fingerprint(entry.path)))
+        except OSError:
+            continue
+    return story_fingerprint(story_path, device_key), tuple(sorted(folders))
+
+def _read_index(path: str, generic_key: bytes) -> list:
+    # ri and si are lists of 12 bytes names, like 000\0AB12CD3
+    data = Decryption(generic_key, path=path).result.bytes or b''
+    return [data[i:i + 12].decode('utf-8', 'replace') for i in range(0, len(data) - 11, 12)]
+
+def _missing_assets(story_path: str, generic_key: bytes) -> list:
+    missing = []
+    for index, folder in (('ri', 'rf'), ('si', 'sf')):
+        for name in dict.fromkeys(_read_index(os.path.join(story_path, index), generic_key)):
+            relative = folder + '/' + name.replace('\\', '/')
+            if not os.path.isfile(os.path.join(story_path, relative)):
+                missing.append(relative)
+    return missing
+
+def _check_structure(story_path: str) -> list:
+    # consistency of the indexes sizes with the ni header, nodes aren't decoded
+    problems = []
+    header = NodeTable.read_header(os.path.join(story_path, 'ni'))
+    ni_size = os.path.getsize(os.path.join(story_path, 'ni'))
+
+    if header['node_size'] < struct.calcsize(NodeTable.NODE_FIELDS):
+        problems.append(f"ni: invalid node size {header['node_size']}")
+    elif header['count'] < 0 or header['nodes_list'] + header['count'] * header['node_size'] > ni_size:
+        problems.append(f"ni: {header['count']} nodes announced, file is truncated")
+
+    for name, entry_size, expected in (
+        ('ri', 12, header['image_assets_count']),
+        ('si', 12, header['sound_assets_count']),
+        ('li', 4, None),
+    ):
+        size = os.path.getsize(os.path.join(story_path, name))
+        if size % entry_size:
+            problems.append(f"{name}: size {size} isn't a multiple of {entry_size}")
+        elif expected is not None and size // entry_size < expected:
+            problems.append(f"{name}: {size // entry_size} entries, {expected} announced")
+
+    return problems
+
+def verify_story(story_path: str, device_key: bytes, generic_key: bytes | None = None) -> dict:
+    """
+    Checks a .content/<id>/ folder without parsing its nodes: required files,
+    indexes consistent with the ni header, and authorization (bt).
+    With the generic key, the assets listed by ri and si are checked to exist as well.
+    """
+    result = {'status': None, 'authorized': False, 'missing': [], 'problems': []}
+
+    result['missing'] = [name for name in REQUIRED_FILES if not os.path.isfile(os.path.join(story_path, name))]
+    result['missing'] += [name + '/' for name in REQUIRED_FOLDERS if not os.path.isdir(os.path.join(story_path, name))]
+
+    if 'ni' not in result['missing'] and not {'ri', 'si', 'li'} & set(result['missing']):
+        try:
+            result['problems'] = _check_structure(story_path)
+        except (OSError, ValueError) as e:
+            result['problems'] = [f"ni: {e}"]
+
+    if generic_key is not None and not result['missing']:
+        try:
+            result['missing'] = _missing_assets(story_path, generic_key)
+        except (OSError, ValueError) as e:
+            result['problems'].append(f"ri/si: {e}")
+
+    if 'bt' not in result['missing'] and 'ri' not in result['missing']:
+        try:
+            result['authorized'] = is_authorized(os.path.join(story_path, 'bt'), os.path.join(story_path, 'ri'), device_key)
+        except (OSError, ValueError) as e:
+            result['problems'].append(f"bt: {e}")
+
+    if result['missing']:
+        result['status'] = MISSING
+    elif result['problems']:
+        result['status'] = CORRUPT
+    else:
+        result['status'] = AUTHORIZED if result['authorized'] else UNAUTHORIZED
+    return result
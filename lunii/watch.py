@@ -0,0 +1,82 @@
+import os
+import sys
+import select
+import ctypes
+import ctypes.util
+
+# inotify(7) events worth a rescan
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+class InotifyWatcher:
+    """
+    Waits for changes in a set of folders with Linux inotify, through ctypes.
+    Watches aren't recursive: every folder to watch is added on its own.
+    Only changes made by this machine are seen (not by the device itself while mounted).
+    """
+    def __init__(self):
+        self.__libc = _libc()
+        if self.__libc is None:
+            raise OSError("inotify is not available on this platform")
+
+        self.fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched = set()
+
+    @staticmethod
+    def available() -> bool:
+        return _libc() is not None
+
+    def add(self, path: str):
+        # adding a folder twice only updates its watch, and a folder
+        # deleted then created again needs a new one, so it is always added
+        if self.__libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK) >= 0:
+            self.watched.add(path)
+        else:
+            self.watched.discard(path)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Blocks until a watched folder changes, or timeout elapses.
+        Returns True on changes, pending events are consumed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
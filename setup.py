@@ -20,8 +20,12 @@ setup(
         'appdirs',
         'requests',
     ],
+    extras_require={
+        # NumPy backend of utils.decrypt_blocks()
+        'numpy': ['numpy'],
+    },
     entry_points={
-        'console_scripts': ['lunii-cli=lumiios.cli:main']
+        'console_scripts': ['lunii=lunii.cli:main', 'lunii-cli=lunii.cli:main']
     },
     classifiers=[
         'Development Status :: 3 - Alpha',
@@ -0,0 +1,136 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from lunii.utils import StoryMetadata, iter_json_object
+
+PACKS = {
+    "response": {
+        "pack-1": {
+            "uuid": "0123456789abcdef0123456789abcdef",
+            "keywords": "forêt, loup",
+            "version": 1.5e3,
+            "age": -0.25,
+            "localized_infos": {
+                "fr_FR": {"title": "Le Loup de la forêt", "subtitle": "Épisode 1"},
+                "en_GB": {"title": "The Forest Wolf"},
+            },
+        },
+        "pack-2": {
+            "uuid": "fedcba9876543210fedcba9876543210",
+            "price": 12.5,
+            "tags": [1, 2.25, True, None, "à"],
+            "localized_infos": {"en_GB": {"title": "Noël", "subtitle": ""}},
+        },
+    },
+    "count": 2,
+}
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 100000])
+def test_iter_json_object_chunk_sizes(size):
+    text = json.dumps(PACKS, ensure_ascii=False)
+    assert dict(iter_json_object(split(text, size), ("response",))) == PACKS["response"]
+
+def test_iter_json_object_every_split():
+    # a single cut at every offset, numbers included
+    text = json.dumps(PACKS)
+    for offset in range(1, len(text)):
+        chunks = [text[:offset], text[offset:]]
+        assert dict(iter_json_object(chunks)) == PACKS, offset
+
+@pytest.mark.parametrize("chunks, value", [
+    (['{"a": 1.', '5}'], 1.5),
+    (['{"a": 1.5e', '3}'], 1.5e3),
+    (['{"a": 1.5E', '-', '3}'], 1.5e-3),
+    (['{"a": -', '12', '}'], -12),
+    (['{"a": 12', '}'], 12),
+    (['{"a": 12'], None),
+])
+def test_iter_json_object_split_numbers(chunks, value):
+    if value is None:
+        # truncated document
+        with pytest.raises(ValueError):
+            list(iter_json_object(chunks))
+    else:
+        assert dict(iter_json_object(chunks)) == {"a": value}
+
+class PacksServer:
+    """
+    Serves PACKS with an ETag, as text/plain without charset like raw.githubusercontent.com
+    """
+    etag = '"packs-v1"'
+
+    def __init__(self):
+        self.requests = []
+        body = json.dumps(PACKS, ensure_ascii=False).encode('utf-8')
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                if self.headers.get('If-None-Match') == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', server.etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/packs.json"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def packs_server():
+    server = PacksServer()
+    yield server
+    server.close()
+
+def test_refresh_downloads_then_skips_unchanged(tmp_path, packs_server):
+    filename = str(tmp_path / "titles.json")
+    metadata = StoryMetadata(filename)
+
+    assert metadata.refresh(packs_server.url) is True
+    assert 'If-None-Match' not in packs_server.requests[0]
+
+    metadata.load_titles()
+    story = metadata.get_metadata("0123456789ABCDEF0123456789ABCDEF")
+    # decoded as UTF-8, not as requests' ISO-8859-1 default for text/*
+    assert story['title'] == "Le Loup de la forêt"
+    assert story['subtitle'] == "Épisode 1"
+    assert story['locales']['en_GB'] == {'title': "The Forest Wolf"}
+    assert metadata.get_metadata("76543210")['title'] == "Noël"
+
+    with open(filename, 'rb') as f:
+        written = f.read()
+
+    # 304: nothing is parsed nor written
+    assert metadata.refresh(packs_server.url) is False
+    assert packs_server.requests[1].get('If-None-Match') == packs_server.etag
+    with open(filename, 'rb') as f:
+        assert f.read() == written
+
+def test_refresh_after_etag_change(tmp_path, packs_server):
+    filename = str(tmp_path / "titles.json")
+    metadata = StoryMetadata(filename)
+    assert metadata.refresh(packs_server.url) is True
+
+    packs_server.etag = '"packs-v2"'
+    assert metadata.refresh(packs_server.url) is True
+    assert packs_server.requests[1].get('If-None-Match') == '"packs-v1"'
@@ -0,0 +1,39 @@
+import os
+
+from lunii import Device
+from lunii.synthetic import make_device
+
+def make(tmp_path, packs=3):
+    path = str(tmp_path / "device")
+    uuids = make_device(path, packs=packs, image_size=(8, 8), audio_size=16)
+    return path, uuids
+
+def story_path(path, uuid):
+    return os.path.join(path, '.content', uuid.hex[-8:].upper())
+
+def test_verify_all_authorized(tmp_path):
+    path, uuids = make(tmp_path)
+    results = Device(path, story_cache=False).verify_all()
+    assert list(results) == uuids
+    assert all(result['status'] == 'authorized' for result in results.values())
+
+def test_truncated_ni_is_corrupt(tmp_path):
+    path, uuids = make(tmp_path)
+    with open(os.path.join(story_path(path, uuids[1]), 'ni'), 'wb') as fp:
+        fp.write(b'\x01\x00\x01\x00')
+
+    # one broken pack doesn't abort the others
+    results = Device(path, story_cache=False).verify_all()
+    assert results[uuids[1]]['status'] == 'corrupt'
+    assert results[uuids[1]]['problems']
+    assert results[uuids[0]]['status'] == results[uuids[2]]['status'] == 'authorized'
+
+def test_deleted_asset_is_missing(tmp_path):
+    path, uuids = make(tmp_path)
+    device = Device(path, story_cache=False)
+    device.verify_all()
+
+    os.remove(os.path.join(story_path(path, uuids[0]), 'rf', '000', '00000001'))
+    results = device.verify_all()
+    assert results[uuids[0]]['status'] == 'missing'
+    assert results[uuids[0]]['missing'] == ['rf/000/00000001']